@@ -11,9 +11,11 @@ import logging
 from PIL import Image, ImageDraw
 import numpy as np
 from timeit import default_timer as timer
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from PyPDF2 import PdfReader as pdf2_read
 
-from data.vision import OCR, Recognizer, LayoutRecognizer, TableStructureRecognizer
+from data.vision import Recognizer, TableStructureRecognizer, shared_model, get_ocr, get_layout_recognizer, \
+    get_table_structure_recognizer
 from rag.nlp import rag_tokenizer
 from copy import deepcopy
 from huggingface_hub import snapshot_download
@@ -23,6 +25,8 @@ logging.getLogger("pdfminer").setLevel(logging.WARNING)
 
 PROJECT_BASE = os.getenv("RAG_PROJECT_BASE") or os.getenv("RAG_DEPLOY_BASE")
 RAG_BASE = os.getenv("RAG_BASE")
+# 单个 PDF 内按页并行 OCR 的线程数（ONNX Runtime 推理时释放 GIL，多线程可以用满多核）
+OCR_PAGE_WORKERS = int(os.getenv("RAG_OCR_PAGE_WORKERS", "0")) or max(1, (os.cpu_count() or 2) // 2)
 
 
 def get_project_base_directory(*args):
@@ -56,34 +60,42 @@ def extract_tables_manually(pdf_path):
         logging.error(f"❌ `pdfplumber` 解析表格失败: {e}")
     return tables_data
 
+def load_updown_concat_model():
+    """加载上下文本块拼接判断的 XGBoost 模型"""
+    model = xgb.Booster()
+    if torch.cuda.is_available():
+        model.set_param({"device": "cuda"})
+    try:
+        model_dir = os.path.join(
+            get_project_base_directory(),
+            "rag/res/data")
+        model.load_model(os.path.join(
+            model_dir, "updown_concat_xgb.model"))
+    except Exception as e:
+        model_dir = snapshot_download(
+            repo_id="InfiniFlow/text_concat_xgb_v1.0",
+            local_dir=os.path.join(get_project_base_directory(), "rag/res/data"),
+            local_dir_use_symlinks=False)
+        model.load_model(os.path.join(
+            model_dir, "updown_concat_xgb.model"))
+    return model
+
+
 class PdfParser:
 
     def __init__(self):
-        self.ocr = OCR()
+        # 模型由进程级注册表共享：每个进程只加载一次，不随每个文件 / 解析器实例重复加载
+        self.ocr = get_ocr()
         if hasattr(self, "model_speciess"):
-            self.layouter = LayoutRecognizer("layout." + self.model_speciess)
+            self.layouter = get_layout_recognizer("layout." + self.model_speciess)
         else:
-            self.layouter = LayoutRecognizer("layout")
-        self.tbl_det = TableStructureRecognizer()
+            self.layouter = get_layout_recognizer("layout")
+        self.tbl_det = get_table_structure_recognizer()
 
-        self.updown_cnt_mdl = xgb.Booster()
-        if torch.cuda.is_available():
-            self.updown_cnt_mdl.set_param({"device": "cuda"})
-        try:
-            model_dir = os.path.join(
-                get_project_base_directory(),
-                "rag/res/data")
-            self.updown_cnt_mdl.load_model(os.path.join(
-                model_dir, "updown_concat_xgb.model"))
-        except Exception as e:
-            model_dir = snapshot_download(
-                repo_id="InfiniFlow/text_concat_xgb_v1.0",
-                local_dir=os.path.join(get_project_base_directory(), "rag/res/data"),
-                local_dir_use_symlinks=False)
-            self.updown_cnt_mdl.load_model(os.path.join(
-                model_dir, "updown_concat_xgb.model"))
+        self.updown_cnt_mdl = shared_model("updown_concat_xgb", load_updown_concat_model)
 
         self.page_from = 0
+        self.ocr_workers = OCR_PAGE_WORKERS
         """
         If you have trouble downloading HuggingFace models, -_^ this might help!!
 
@@ -317,20 +329,31 @@ class PdfParser:
                 b["SP"] = ii
 
     def __ocr(self, pagenum, img, chars, ZM=3):
+        bxs, lefted_chars, mean_height = self._ocr_page(pagenum, img, chars, ZM)
+        self.boxes.append(bxs)
+        self.lefted_chars.extend(lefted_chars)
+        self.mean_height[pagenum - 1] = mean_height
+
+    def _ocr_page(self, pagenum, img, chars, ZM=3):
+        """
+        单页 OCR，不修改 self（可在多个线程中并行调用）
+        返回 (该页文本框, 未落入任何文本框的字符, 该页字符平均高度)
+        """
+        mean_height = self.mean_height[pagenum - 1]
+        lefted_chars = []
         if isinstance(img, Image.Image):
             img = np.array(img)
         bxs = self.ocr.detect(img)
 
         if not bxs:
-            self.boxes.append([])
-            return
+            return [], lefted_chars, mean_height
         bxs = [(line[0], line[1][0]) for line in bxs]
         bxs = Recognizer.sort_Y_firstly(
             [{"x0": b[0][0] / ZM, "x1": b[1][0] / ZM,
               "top": b[0][1] / ZM, "text": "", "txt": t,
               "bottom": b[-1][1] / ZM,
               "page_number": pagenum} for b, t in bxs if b[0][0] <= b[1][0] and b[0][1] <= b[-1][1]],
-            self.mean_height[-1] / 3
+            mean_height / 3
         )
 
         # merge chars in the same rect
@@ -338,12 +361,12 @@ class PdfParser:
                 chars, self.mean_width[pagenum - 1] // 4):
             ii = Recognizer.find_overlapped(c, bxs)
             if ii is None:
-                self.lefted_chars.append(c)
+                lefted_chars.append(c)
                 continue
             ch = c["bottom"] - c["top"]
             bh = bxs[ii]["bottom"] - bxs[ii]["top"]
             if abs(ch - bh) / max(ch, bh) >= 0.7 and c["text"] != ' ':
-                self.lefted_chars.append(c)
+                lefted_chars.append(c)
                 continue
             if c["text"] == " " and bxs[ii]["text"]:
                 if re.match(r"[0-9a-zA-Z,.?;:!%%]", bxs[ii]["text"][-1]):
@@ -360,10 +383,27 @@ class PdfParser:
                                                         dtype=np.float32))
             del b["txt"]
         bxs = [b for b in bxs if b["text"]]
-        if self.mean_height[-1] == 0:
-            self.mean_height[-1] = np.median([b["bottom"] - b["top"]
-                                              for b in bxs])
-        self.boxes.append(bxs)
+        if mean_height == 0:
+            mean_height = np.median([b["bottom"] - b["top"]
+                                     for b in bxs])
+        return bxs, lefted_chars, mean_height
+
+    def _parallel_ocr(self, ZM, callback=None):
+        """按页并行 OCR（共享同一组 ONNX 会话），结果按页码顺序拼回 self.boxes，后续版面分析 / 合并不受影响"""
+        n = len(self.page_images)
+        with ThreadPoolExecutor(max_workers=min(self.ocr_workers, max(n, 1)), thread_name_prefix="ocr") as pool:
+            futures = [pool.submit(self._ocr_page, i + 1, img,
+                                   self.page_chars[i] if not self.is_english else [], ZM)
+                       for i, img in enumerate(self.page_images)]
+            for done, _ in enumerate(as_completed(futures), 1):
+                if callback and done % 6 == 0:
+                    callback(prog=done * 0.6 / n, msg="")
+
+        for i, future in enumerate(futures):
+            bxs, lefted_chars, mean_height = future.result()
+            self.boxes.append(bxs)
+            self.lefted_chars.extend(lefted_chars)
+            self.mean_height[i] = mean_height
 
     def _layouts_rec(self, ZM, drop=True):
         assert len(self.page_images) == len(self.boxes)
@@ -1063,9 +1103,13 @@ class PdfParser:
                     chars[j]["text"] += " "
                 j += 1
 
-            self.__ocr(i + 1, img, chars, zoomin)
-            if callback and i % 6 == 5:
-                callback(prog=(i + 1) * 0.6 / len(self.page_images), msg="")
+            if self.ocr_workers <= 1:
+                self.__ocr(i + 1, img, chars, zoomin)
+                if callback and i % 6 == 5:
+                    callback(prog=(i + 1) * 0.6 / len(self.page_images), msg="")
+
+        if self.ocr_workers > 1:
+            self._parallel_ocr(zoomin, callback)
         # print("OCR:", timer()-st)
 
         if not self.is_english and not any(
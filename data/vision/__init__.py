@@ -5,6 +5,7 @@ from .ocr import OCR
 from .recognizer import Recognizer
 from .layout_recognizer import LayoutRecognizer
 from .table_structure_recognizer import TableStructureRecognizer
+from .model_registry import shared_model, get_ocr, get_layout_recognizer, get_table_structure_recognizer
 
 def traversal_files(base):
     for root, ds, fs in os.walk(base):
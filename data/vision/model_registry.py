@@ -0,0 +1,48 @@
+"""
+进程级共享模型注册表：
+- 每个模型在首次使用时加载一次，之后同一进程内的所有解析器 / 线程共用同一实例
+- 每个模型一把锁（双重检查），并发首次访问只加载一次，不同模型可并行加载
+- ONNX Runtime 的 InferenceSession.run 与 xgboost Booster.predict 均为线程安全，共享实例可直接并发调用
+"""
+import logging
+import threading
+from timeit import default_timer as timer
+
+from .ocr import OCR
+from .layout_recognizer import LayoutRecognizer
+from .table_structure_recognizer import TableStructureRecognizer
+
+_models = {}
+_locks = {}
+_registry_lock = threading.Lock()
+
+
+def shared_model(name: str, factory):
+    """返回名为 `name` 的共享模型，不存在时调用 factory() 加载"""
+    model = _models.get(name)
+    if model is not None:
+        return model
+    with _registry_lock:
+        lock = _locks.setdefault(name, threading.Lock())
+    with lock:
+        if name not in _models:
+            st = timer()
+            _models[name] = factory()
+            logging.info(f"Model {name} loaded in {timer() - st:.2f}s")
+        return _models[name]
+
+
+def get_ocr() -> OCR:
+    return shared_model("ocr", OCR)
+
+
+def get_layout_recognizer(domain: str = "layout") -> LayoutRecognizer:
+    return shared_model(domain, lambda: LayoutRecognizer(domain))
+
+
+def get_table_structure_recognizer() -> TableStructureRecognizer:
+    return shared_model("tsr", TableStructureRecognizer)
+
+
+def loaded_models() -> list[str]:
+    return list(_models)
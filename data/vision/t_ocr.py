@@ -9,7 +9,7 @@ sys.path.insert(
             '../../')))
 
 from data.vision.seeit import draw_box
-from data.vision import OCR, init_in_out
+from data.vision import get_ocr, init_in_out
 import argparse
 import numpy as np
 
@@ -17,7 +17,7 @@ def run_ocr(args):
     """
     运行 OCR 解析，并将图片保存为 0.jpg, 1.jpg, 2.jpg ...
     """
-    ocr = OCR()
+    ocr = get_ocr()
     images, outputs = init_in_out(args)
 
     ocr_texts = []
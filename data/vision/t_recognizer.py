@@ -9,7 +9,8 @@ sys.path.insert(
             '../../')))
 
 from data.vision.seeit import draw_box
-from data.vision import Recognizer, LayoutRecognizer, TableStructureRecognizer, OCR, init_in_out
+from data.vision import Recognizer, LayoutRecognizer, TableStructureRecognizer, get_ocr, \
+    get_table_structure_recognizer, init_in_out
 import argparse
 import re
 import numpy as np
@@ -50,8 +51,8 @@ def run_layout_recognition(inputs, mode="layout", threshold=0.5, output_dir="./l
         recognizer = Recognizer(labels, "layout", os.path.join(os.path.dirname(__file__), "../../rag/res/data/"))
     elif mode.lower() == "tsr":
         labels = TableStructureRecognizer.labels
-        recognizer = TableStructureRecognizer()
-        ocr = OCR()
+        recognizer = get_table_structure_recognizer()
+        ocr = get_ocr()
 
     layouts = recognizer(images, float(threshold))
     results = []
@@ -2,12 +2,17 @@
 import os
 import json
 import re
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from tqdm import tqdm
 from timeit import default_timer as timer
 from io import BytesIO
 from docx import Document
 import pandas as pd
 from data.parser import PdfParser, ExcelParser
+from data.parser.pdf_parser import OCR_PAGE_WORKERS
+from rag.page_cache import page_cache
 from docx2pdf import convert
 import os
 from pathlib import Path
@@ -20,6 +25,9 @@ OUTPUT_FILE = os.path.join(os.path.dirname(__file__), "..", "rag", "res", "proce
 
 UPLOAD_DIR = Path(__file__).resolve().parent.parent / "data" / "policy"
 
+# 并行解析的进程数（每个进程各自加载一份 OCR / 版面模型，单个进程内 ONNX 已使用 2 个线程）
+PARSE_WORKERS = max(1, min(4, (os.cpu_count() or 2) // 2))
+
 # 确保存储目录存在
 os.makedirs(os.path.dirname(OUTPUT_FILE), exist_ok=True)
 
@@ -96,8 +104,8 @@ def chunk_text(text, chunk_size=128):
     return chunks
 
 
-def process_policy_file(file_path):
-    """根据文件类型选择合适的解析器"""
+def process_policy_file(file_path, ocr_workers=None):
+    """根据文件类型选择合适的解析器。`ocr_workers`: PDF 按页并行 OCR 的线程数，默认 OCR_PAGE_WORKERS"""
     ext = os.path.splitext(file_path)[1].lower()
 
     if ext not in [".pdf", ".xlsx"]:
@@ -105,6 +113,9 @@ def process_policy_file(file_path):
         return None
 
     parser = {"pdf": Pdf(), "xlsx": ExcelParser()}.get(ext[1:])
+    page_cum_height = None
+    if ext == ".pdf" and ocr_workers:
+        parser.ocr_workers = ocr_workers
 
     try:
         if ext == ".xlsx":
@@ -125,6 +136,13 @@ def process_policy_file(file_path):
                 return None
         else:
             text_content, tables = parser(file_path)
+            # ✅ 记录各页累计高度，坐标标签的 top/bottom 是跨页累计值，高亮时据此换算回页内坐标
+            page_cum_height = [round(float(h), 2) for h in parser.page_cum_height]
+            # ✅ 预渲染前几页到页面图像缓存，高亮时直接复用
+            try:
+                page_cache.prewarm(file_path)
+            except Exception as e:
+                print(f"⚠️ 页面预渲染失败: {file_path}, {e}")
 
         print(f"🔍 DEBUG: {file_path} 解析返回：{type(text_content)}, {type(tables)}")
 
@@ -147,11 +165,14 @@ def process_policy_file(file_path):
             tables = []
 
         # ✅ 保持 `text_chunks` 里带有位置信息
-        return {
+        result = {
             "file_name": os.path.basename(file_path),
             "text_chunks": chunk_text("\n".join(text_lines)),  # ✅ 这里不会丢失位置信息
             "tables": tables
         }
+        if page_cum_height is not None:
+            result["page_cum_height"] = page_cum_height
+        return result
 
     except Exception as e:
         import traceback
@@ -184,43 +205,103 @@ def convert_all_docx_to_pdf():
 
 # ========== 📌 处理所有政策文件 ==========
 
-def process_policy_files():
-    """🔄 先转换 `.docx`，再遍历 `.pdf` 和 `.xlsx` 解析"""
-    print("📂 正在加载政策文件...")
-
-    convert_all_docx_to_pdf()  # ✅ **先转换 Word**
+def _parse_worker(file_path, ocr_workers=None):
+    """子进程入口：解析单个文件，返回 (解析结果, 页数, 耗时)。模型由子进程内的注册表加载一次，后续文件复用"""
+    start = timer()
+    parsed = process_policy_file(file_path, ocr_workers)
+    pages = len(parsed.get("page_cum_height", [0])) - 1 if parsed else 0
+    return parsed, pages, timer() - start
+
+
+def iter_parsed_files(file_paths, workers=PARSE_WORKERS):
+    """
+    解析多个文件，按完成顺序逐个返回 (文件路径, 解析结果或 None, 页数)
+    - `workers` > 1 时分发到进程池（spawn 启动，避免 fork 带上 web 进程里的线程和锁）
+    - 单个文件失败只影响它自己
+    - 多进程时按进程数分摊每个文件的按页 OCR 线程，避免线程总数远超核数
+    """
+    if workers <= 1 or len(file_paths) <= 1:
+        for file_path in file_paths:
+            parsed, pages, _ = _parse_worker(file_path)
+            yield file_path, parsed, pages
+        return
 
+    workers = min(workers, len(file_paths))
+    ocr_workers = max(1, OCR_PAGE_WORKERS // workers)
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+        futures = {pool.submit(_parse_worker, file_path, ocr_workers): file_path for file_path in file_paths}
+        for future in as_completed(futures):
+            try:
+                parsed, pages, _ = future.result()
+            except Exception as e:  # 子进程崩溃等
+                print(f"⚠️ 解析进程异常: {futures[future]}, {e}")
+                parsed, pages = None, 0
+            yield futures[future], parsed, pages
+
+
+def pending_policy_files(policy_dir=POLICY_DIR) -> list[str]:
+    """目录下尚未解析的 `.pdf` / `.xlsx` 文件"""
     existing_data = load_existing_data()
-    new_data = {}
-
-    # **遍历目录，解析 `.pdf` 和 `.xlsx`**
-    for root, _, files in os.walk(POLICY_DIR):
-        for file in tqdm(files, desc="解析政策文件"):
-            file_path = os.path.join(root, file)
-
+    pending = []
+    for root, _, files in os.walk(policy_dir):
+        for file in files:
             # ✅ **只处理 `.pdf` 和 `.xlsx`**
             if not file.endswith((".pdf", ".xlsx")):
                 continue
-
             if file in existing_data:  # ✅ **避免重复解析**
                 print(f"⏩ 跳过已解析文件: {file}")
                 continue
+            pending.append(os.path.join(root, file))
+    return pending
 
-            print(f"🔍 解析政策文件: {file}")
-            parsed_data = process_policy_file(file_path)
 
+def process_policy_files(workers=PARSE_WORKERS, callback=None, policy_dir=POLICY_DIR, convert_docx=True):
+    """
+    🔄 先转换 `.docx`，再并行解析 `.pdf` 和 `.xlsx`
+    - 每个文件解析完成后立即写入 JSON，中途失败不会丢失已完成的文件
+    - `callback(prog=进度, msg=进度说明)`：每完成一个文件调用一次，说明中包含 文件/s 与 页/s
+    返回 {"parsed": 成功数, "parsed_files": [成功文件名], "failed": [失败文件名], "files_per_sec", "pages_per_sec"}
+    """
+    print("📂 正在加载政策文件...")
+
+    if convert_docx:
+        convert_all_docx_to_pdf()  # ✅ **先转换 Word**
+
+    file_paths = pending_policy_files(policy_dir)
+    summary = {"parsed": 0, "parsed_files": [], "failed": [], "files_per_sec": 0.0, "pages_per_sec": 0.0}
+    if not file_paths:
+        print("✅ 没有新文件需要解析，所有政策数据已是最新！")
+        return summary
+
+    start = timer()
+    done = pages_done = 0
+    with tqdm(total=len(file_paths), desc="解析政策文件") as bar:
+        for file_path, parsed_data, pages in iter_parsed_files(file_paths, workers):
+            file = os.path.basename(file_path)
+            done += 1
+            pages_done += pages
             if parsed_data:
-                new_data[file] = parsed_data
+                commit_parsed_file(file, parsed_data)
+                summary["parsed"] += 1
+                summary["parsed_files"].append(file)
                 print(f"✅ 解析成功: {file}")
             else:
+                summary["failed"].append(file)
                 print(f"❌ 解析失败: {file}")
 
-    if new_data:
-        existing_data.update(new_data)
-        save_json(existing_data)
-        print(f"✅ 解析完成！共新增 {len(new_data)} 条政策数据。")
-    else:
-        print("✅ 没有新文件需要解析，所有政策数据已是最新！")
+            elapsed = max(timer() - start, 1e-6)
+            summary["files_per_sec"] = round(done / elapsed, 3)
+            summary["pages_per_sec"] = round(pages_done / elapsed, 3)
+            bar.update(1)
+            bar.set_postfix(pages_per_sec=summary["pages_per_sec"])
+            if callback:
+                callback(prog=done / len(file_paths),
+                         msg=f"{done}/{len(file_paths)} 文件, {summary['files_per_sec']} 文件/s, "
+                             f"{summary['pages_per_sec']} 页/s")
+
+    print(f"✅ 解析完成！共新增 {summary['parsed']} 条政策数据，失败 {len(summary['failed'])} 个。")
+    return summary
 
 
 # ========== 📌 加载 & 存储 JSON ==========
@@ -236,9 +317,22 @@ def load_existing_data():
 
 
 def save_json(data):
-    """存储 JSON 数据"""
-    with open(OUTPUT_FILE, "w", encoding="utf-8") as f:
+    """存储 JSON 数据（先写临时文件再替换，逐个文件提交时中途退出也不会留下半个 JSON）"""
+    tmp_file = f"{OUTPUT_FILE}.{os.getpid()}.tmp"
+    with open(tmp_file, "w", encoding="utf-8") as f:
         json.dump(data, f, ensure_ascii=False, indent=4)
+    os.replace(tmp_file, OUTPUT_FILE)
+
+
+_save_lock = threading.Lock()
+
+
+def commit_parsed_file(file, parsed_data):
+    """把单个文件的解析结果合并写入 JSON（重新读取最新数据，避免覆盖其他接口同时做的修改）"""
+    with _save_lock:
+        data = load_existing_data()
+        data[file] = parsed_data
+        save_json(data)
 
 
 # ========== 📌 主运行入口 ==========
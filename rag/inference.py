@@ -1,24 +1,45 @@
 # -*- coding: utf-8 -*-
+import asyncio
 import os
 import re
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 
-from rag.llm.config import OLLAMA_CONFIG
-from rag.llm.ollama_client import OllamaClient
+from rag.llm.config import OLLAMA_CONFIG, KEYWORD_CACHE_CONFIG, CONTEXT_CONFIG, ANSWER_CACHE_CONFIG, \
+    HIGHLIGHT_CONFIG
+from rag.llm.ollama_client import OllamaClient, STREAM_ERROR_PREFIX
+from rag.llm.async_ollama_client import AsyncOllamaClient
 from rag.llm.policy_engine import PolicyQAEngine
+from rag.llm.context_packer import ContextPacker
+from rag.llm.keyword_cache import KeywordCache
+from rag.llm.scheduler import LLMScheduler, PRIORITY_ANSWER
+from rag.llm.answer_cache import AnswerCache
 from rag.nlp.search import SearchEngine
 from rag.nlp import rag_tokenizer
-from rag.match import process_pdf_highlight
+from rag.match import highlight_citations, HIGHLIGHT_MODES
+from rag.page_cache import HIGHLIGHT_DIR
 
 # 初始化 RAG 组件
 search_engine = SearchEngine(score_threshold=0.5)  # 设定最小相关性
-client = OllamaClient(OLLAMA_CONFIG)
-engine = PolicyQAEngine(client)
+scheduler = LLMScheduler.from_config(OLLAMA_CONFIG)  # 同步/异步客户端共用，统一限制每个模型的在途请求
+client = OllamaClient(OLLAMA_CONFIG, scheduler)
+async_client = AsyncOllamaClient(OLLAMA_CONFIG, scheduler)
+context_packer = ContextPacker(**CONTEXT_CONFIG)
+engine = PolicyQAEngine(client, async_client, context_packer)
+keyword_cache = KeywordCache(**KEYWORD_CACHE_CONFIG)
+answer_cache = AnswerCache(**ANSWER_CACHE_CONFIG)
+
+# 推测检索：LLM 关键词提取的最长等待时间（秒），超时直接使用 NLP 关键词的检索结果
+LLM_KEYWORD_DEADLINE = 15
+_pipeline_executor = ThreadPoolExecutor(max_workers=4)
 
 
 # **OCR 相关路径**
-pdf_base_path = "C:/Users/ROG/PycharmProjects/final/data/policy"  # 存放政策文件的 PDF 目录
-# output_dir = "C:/Users/ROG/PycharmProjects/final/rag/ocr_results"  # OCR 解析后的图片存放目录
-output_dir = "C:/Users/ROG/PycharmProjects/final/ocr_results"  # OCR 解析后的图片存放目录
+pdf_base_path = os.path.join(os.path.dirname(__file__), "..", "data", "policy")  # 存放政策文件的 PDF 目录
+output_dir = HIGHLIGHT_DIR  # 高亮图片存放目录（内容寻址，跨请求复用）
+highlight_mode = HIGHLIGHT_CONFIG["mode"]
+if highlight_mode not in HIGHLIGHT_MODES:
+    raise ValueError(f"HIGHLIGHT_CONFIG 中的高亮模式无效: {highlight_mode}，可选 {HIGHLIGHT_MODES}")
 
 def filter_top_results(search_results):
     """
@@ -42,18 +63,9 @@ def filter_top_results(search_results):
 
 def format_search_results(search_results):
     """
-    格式化搜索结果，生成清晰的 LLM 输入
+    格式化搜索结果，生成清晰的 LLM 输入（去坐标标签、去重叠、按分数装入 token 预算）
     """
-    formatted_texts = []
-    for result in search_results:
-        doc_name = result["文件"]
-        score = result["搜索分数"]
-        sentences = "\n".join([f"({round(sent[1], 2)}) {sent[0]}" for sent in result["相关内容"]])
-
-        formatted_text = f"📄 文件: {doc_name} (相关性: {score})\n{sentences}"
-        formatted_texts.append(formatted_text)
-
-    return "\n\n".join(formatted_texts)
+    return context_packer.pack(search_results)
 
 
 def extract_keywords_nlp(question: str) -> tuple[list[str], dict[str, list[str]]]:
@@ -65,22 +77,33 @@ def extract_keywords_nlp(question: str) -> tuple[list[str], dict[str, list[str]]
     text_tokens = set(rag_tokenizer.tokenize(question).split())  # 使用 rag_tokenizer 进行分词
     return list(text_tokens), {}  # NLP 版不提供近义词扩展
 
-def extract_keywords(question: str, use_llm=True, retries=2) -> tuple[list[str], dict[str, list[str]]]:
+def extract_keywords(question: str, use_llm=True, retries=2, timeout=None) -> tuple[list[str], dict[str, list[str]]]:
     """
     提取搜索关键词，并进行近义词扩展：
     - `use_llm=True`：优先使用 LLM 提取关键词 + 近义词
     - `use_llm=False`：使用 NLP 规则分词
     - LLM 失败两次后，自动回退到 NLP
+    - `timeout`: 每次 LLM 调用的时限（排队 + 生成，秒），超时后不再重试直接回退
+    - LLM 结果按（归一化问题, 模型）缓存，命中时不再调用 LLM
     """
     if use_llm:
+        cached = keyword_cache.get(question, client.models["chat"])
+        if cached:
+            return cached
+
         for attempt in range(retries):
             try:
-                result = client.extract_keywords(question)  # LLM 提取关键词 + 近义词
+                result = client.extract_keywords(question, timeout)  # LLM 提取关键词 + 近义词
                 if isinstance(result, tuple) and len(result) == 2:
                     keywords, synonyms = result  # 确保返回格式正确
                     if isinstance(keywords, list) and isinstance(synonyms, dict):
+                        if keywords:
+                            keyword_cache.put(question, client.models["chat"], keywords, synonyms)
                         return keywords, synonyms  # LLM 结果有效，返回
 
+            except TimeoutError as e:
+                print(f"⚠️ LLM 关键词提取超时: {e}")
+                break
             except Exception as e:
                 print(f"⚠️ LLM 第 {attempt + 1} 次关键词提取失败，错误: {e}，重新请求...")
 
@@ -89,37 +112,232 @@ def extract_keywords(question: str, use_llm=True, retries=2) -> tuple[list[str],
     return extract_keywords_nlp(question)  # NLP 规则分词（回退方案）
 
 
+async def extract_keywords_async(question: str, use_llm=True, retries=2) -> tuple[list[str], dict[str, list[str]]]:
+    """extract_keywords 的异步版本，LLM 调用不阻塞事件循环"""
+    if use_llm:
+        cached = keyword_cache.get(question, async_client.models["chat"])
+        if cached:
+            return cached
+
+        for attempt in range(retries):
+            try:
+                result = await async_client.extract_keywords(question)
+                if isinstance(result, tuple) and len(result) == 2:
+                    keywords, synonyms = result
+                    if isinstance(keywords, list) and isinstance(synonyms, dict):
+                        if keywords:
+                            keyword_cache.put(question, async_client.models["chat"], keywords, synonyms)
+                        return keywords, synonyms
+
+            except Exception as e:
+                print(f"⚠️ LLM 第 {attempt + 1} 次关键词提取失败，错误: {e}，重新请求...")
+
+        print("⚠️ LLM 连续失败，回退到 NLP 分词...")
+
+    return extract_keywords_nlp(question)
+
+
+class StageTimer:
+    """记录各阶段相对起点的 (开始, 结束) 秒数，用于观察阶段之间的重叠"""
+
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self.stages = {}
+
+    def _mark(self, name, start):
+        self.stages[name] = (round(start, 3), round(time.perf_counter() - self.t0, 3))
 
+    def run(self, name, func, *args):
+        start = time.perf_counter() - self.t0
+        try:
+            return func(*args)
+        finally:
+            self._mark(name, start)
 
-def answer_policy_question(question, top_k=5):
+    async def arun(self, name, coro):
+        start = time.perf_counter() - self.t0
+        try:
+            return await coro
+        finally:
+            self._mark(name, start)
+
+    def report(self):
+        print("⏱️ **阶段耗时:** " + " | ".join(f"{k}: {a:.2f}s → {b:.2f}s" for k, (a, b) in self.stages.items()))
+
+
+def expand_query(keywords, synonyms) -> set[str]:
+    """关键词 + 近义词"""
+    expanded_query = set(keywords)
+    for key, syns in synonyms.items():
+        expanded_query.update(syns)
+    return expanded_query
+
+
+def merge_search_results(results, extra_results, top_k=5):
+    """合并两次检索结果，同一文段保留较高分数，按分数重新排序"""
+    merged = {}
+    for res in results + extra_results:
+        key = (res["文件"], res["相关内容"][0][0])
+        if key not in merged or res["搜索分数"] > merged[key]["搜索分数"]:
+            merged[key] = res
+    return sorted(merged.values(), key=lambda r: r["搜索分数"], reverse=True)[:top_k]
+
+
+def speculative_search(question, top_k=5, deadline=LLM_KEYWORD_DEADLINE):
+    """
+    推测检索：
+    1. LLM 关键词提取与 NLP 关键词检索同时开始
+    2. LLM 关键词到达后，只对新增的关键词做增量检索并合并
+    3. LLM 超过 `deadline` 未返回时，直接使用 NLP 检索结果；排队与 HTTP 请求都受同一时限约束，
+       后台线程随之结束，不会在截止之后继续占用模型名额
+    返回 (search_query, search_results, timer)
+    """
+    timer = StageTimer()
+    llm_future = _pipeline_executor.submit(timer.run, "llm_keywords", extract_keywords, question, True, 1, deadline)
+    nlp_query = set(extract_keywords_nlp(question)[0])
+    spec_future = _pipeline_executor.submit(timer.run, "speculative_search", search_engine.search,
+                                            " ".join(nlp_query), top_k)
+
+    try:
+        expanded_query = expand_query(*llm_future.result(timeout=deadline))
+    except FutureTimeoutError:
+        llm_future.cancel()  # 线程池尚未开始执行时直接取消
+        print(f"⚠️ LLM 关键词提取超过 {deadline}s，直接使用 NLP 检索结果")
+        expanded_query = set()
+
+    results = spec_future.result()
+    delta = expanded_query - nlp_query
+    if delta:
+        delta_results = timer.run("delta_search", search_engine.search, " ".join(delta), top_k)
+        results = merge_search_results(results, delta_results, top_k)
+
+    timer.report()
+    return " ".join(nlp_query | expanded_query), results, timer
+
+
+async def speculative_search_async(question, top_k=5, deadline=LLM_KEYWORD_DEADLINE):
+    """speculative_search 的异步版本"""
+    timer = StageTimer()
+    llm_task = asyncio.create_task(timer.arun("llm_keywords", extract_keywords_async(question, use_llm=True)))
+    nlp_query = set(extract_keywords_nlp(question)[0])
+    spec_task = asyncio.create_task(timer.arun(
+        "speculative_search", asyncio.to_thread(search_engine.search, " ".join(nlp_query), top_k)))
+
+    try:
+        # 超时后取消 LLM 请求（中断 HTTP 请求并释放模型名额），合并到同一请求的其他会话会重新发起
+        expanded_query = expand_query(*await asyncio.wait_for(llm_task, deadline))
+    except asyncio.TimeoutError:
+        print(f"⚠️ LLM 关键词提取超过 {deadline}s，直接使用 NLP 检索结果")
+        expanded_query = set()
+
+    results = await spec_task
+    delta = expanded_query - nlp_query
+    if delta:
+        delta_results = await timer.arun(
+            "delta_search", asyncio.to_thread(search_engine.search, " ".join(delta), top_k))
+        results = merge_search_results(results, delta_results, top_k)
+
+    timer.report()
+    return " ".join(nlp_query | expanded_query), results, timer
+
+
+
+
+def embed_question(question):
+    """问题嵌入向量（用于语义答案缓存），失败时返回 None"""
+    try:
+        return client.get_embeddings([question], priority=PRIORITY_ANSWER)[0]
+    except Exception as e:
+        print(f"⚠️ 问题嵌入失败，跳过答案缓存: {e}")
+        return None
+
+
+async def embed_question_async(question):
+    try:
+        return (await async_client.get_embeddings([question], priority=PRIORITY_ANSWER))[0]
+    except Exception as e:
+        print(f"⚠️ 问题嵌入失败，跳过答案缓存: {e}")
+        return None
+
+
+def lookup_answer(question, embedding):
+    """
+    语义答案缓存查询，命中时返回 answer_policy_question 格式的结果（附 cache_hit / cached_question / cache_similarity）
+    - 高亮图片已被清理时，用缓存的回答与文段重新生成
+    """
+    hit = answer_cache.get(embedding, client.models["embedding"])
+    if hit is None:
+        return None
+    result, similarity = hit
+    print(f"⚡ **命中答案缓存** (相似度 {similarity:.3f}): {result['raw_question']}")
+
+    if "highlights" not in result or not all(os.path.exists(path) for path in result["reference_images"]):
+        result["highlights"] = highlight_citations(
+            pdf_base_path, result["final_answer"].split("\n"), result["filtered_results"], output_dir,
+            mode=highlight_mode)
+        result["reference_images"] = [item["图片"] for item in result["highlights"]]
+
+    result.update(cached_question=result["raw_question"], raw_question=question,
+                  cache_hit=True, cache_similarity=similarity)
+    return result
+
+
+def is_cacheable_answer(raw_answer: str, final_answer: str, highlights: list) -> bool:
+    """生成失败（流中出现错误提示）、回答为空或没有任何引用高亮的回答不写入缓存，避免错误被近义问题反复命中"""
+    return bool(final_answer) and bool(highlights) and STREAM_ERROR_PREFIX not in raw_answer
+
+
+def store_answer(embedding, result):
+    """写入语义答案缓存，引用文件为回答所用文段的来源文件"""
+    if "error" in result or not is_cacheable_answer(result["llm_thinking"], result["final_answer"],
+                                                     result["highlights"]):
+        print("⚠️ 回答生成失败或无引用，不写入答案缓存")
+        return
+    answer_cache.put(result["raw_question"], embedding, client.models["embedding"], result,
+                     [res["文件"] for res in result["filtered_results"]])
+
+
+def answer_policy_question(question, top_k=5, speculative=True, use_cache=True):
     """
     1. 解析问题，提取关键词
-    2. 使用 RAG 进行搜索
+    2. 使用 RAG 进行搜索（`speculative=True` 时与 LLM 关键词提取并行，见 speculative_search）
     3. 结合 LLM 生成答案
     4. 高亮匹配的政策内容
+    `use_cache=True` 时先查语义答案缓存（近义问题直接返回），生成完成后写入缓存
     """
     print(f"\n🔍 **原始查询:** {question}")
 
-    # 获取关键词和近义词
-    keywords, synonyms = extract_keywords(question, use_llm=True)
-
-    # 关键词为空时，返回提示
-    if not keywords:
-        return {
-            "raw_question": question,
-            "error": "❌ 无法解析问题，请尝试更具体的提问。"
-        }
-
-    # 构造最终搜索 Query（包含近义词）
-    expanded_query = set(keywords)
-    for key, syns in synonyms.items():
-        expanded_query.update(syns)
+    embedding = embed_question(question) if use_cache else None
+    cached = lookup_answer(question, embedding) if use_cache else None
+    if cached:
+        return cached
+
+    if speculative:
+        search_query, search_results, timer = speculative_search(question, top_k)
+        stage_timings = timer.stages
+        if not search_query:
+            return {
+                "raw_question": question,
+                "error": "❌ 无法解析问题，请尝试更具体的提问。"
+            }
+    else:
+        # 获取关键词和近义词
+        keywords, synonyms = extract_keywords(question, use_llm=True)
+
+        # 关键词为空时，返回提示
+        if not keywords:
+            return {
+                "raw_question": question,
+                "error": "❌ 无法解析问题，请尝试更具体的提问。"
+            }
+
+        # 构造最终搜索 Query（包含近义词）
+        search_query = " ".join(expand_query(keywords, synonyms))
+        search_results = search_engine.search(search_query, top_k)
+        stage_timings = {}
 
-    search_query = " ".join(expanded_query)
     print(f"🔎 **优化后的搜索 Query:** {search_query}")
 
-    search_results = search_engine.search(search_query, top_k)
-
     if not search_results:
         return {
             "raw_question": question,
@@ -149,19 +367,24 @@ def answer_policy_question(question, top_k=5):
     print("\n📝 **最终回答:**")
     print(cleaned_answer)
 
-    # 高亮匹配的政策内容
+    # 高亮匹配的政策内容（所有引用，按 (文件, 页码) 批量渲染）
     referenced_texts = cleaned_answer.split("\n")
-    matched_passages = process_pdf_highlight(pdf_base_path, referenced_texts, filtered_results, output_dir)
+    highlights = highlight_citations(pdf_base_path, referenced_texts, filtered_results, output_dir, mode=highlight_mode)
 
-    return {
+    result = {
         "raw_question": question,
         "optimized_query": search_query,
         "sorted_results": search_results,
         "filtered_results": filtered_results,
         "llm_thinking": raw_answer,
         "final_answer": cleaned_answer,
-        "reference_images": matched_passages
+        "reference_images": [item["图片"] for item in highlights],
+        "highlights": highlights,
+        "stage_timings": stage_timings
     }
+    if use_cache:
+        store_answer(embedding, result)
+    return result
 
 '''
 # **测试代码**
@@ -0,0 +1,153 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+CACHE_FILE = os.path.join(BASE_DIR, "res", "answer_cache.db")
+POLICY_DIR = os.path.join(BASE_DIR, "..", "data", "policy")
+
+
+def file_fingerprint(filename: str, policy_dir=POLICY_DIR):
+    """政策文件指纹 (大小, 修改时间)，文件不存在时为 None"""
+    try:
+        st = os.stat(os.path.join(policy_dir, filename))
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+
+class AnswerCache:
+    """
+    语义答案缓存：以问题的嵌入向量为键，保存最终回答、引用文段与高亮图片
+    - 查询：与已缓存问题做余弦相似度最近邻，>= `threshold` 视为命中
+    - 失效：命中时校验引用的政策文件指纹，任一文件被修改/删除则丢弃该条；文件管理接口上传 / 删除 / 解析时也会主动失效
+    - 向量常驻内存（numpy 矩阵），sqlite 负责持久化；`max_entries` 超出时按最近访问时间淘汰
+    """
+
+    def __init__(self, path=CACHE_FILE, threshold=0.92, ttl=7 * 24 * 3600, max_entries=2000, policy_dir=POLICY_DIR):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.policy_dir = policy_dir
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS answer_cache (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                model TEXT NOT NULL,
+                question TEXT NOT NULL,
+                embedding BLOB NOT NULL,
+                payload TEXT NOT NULL,
+                files TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )""")
+        self.conn.commit()
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    def _load(self):
+        """加载未过期的向量到内存，按模型分组（不同嵌入模型的向量不可比较）"""
+        self.conn.execute("DELETE FROM answer_cache WHERE created_at < ?", (time.time() - self.ttl,))
+        self.conn.commit()
+        self.index = {}  # model -> (ids, 归一化向量矩阵)
+        rows = self.conn.execute("SELECT id, model, embedding FROM answer_cache").fetchall()
+        for row_id, model, blob in rows:
+            ids, vectors = self.index.setdefault(model, ([], []))
+            ids.append(row_id)
+            vectors.append(np.frombuffer(blob, dtype=np.float32))
+        self.index = {m: (ids, np.vstack(vectors)) for m, (ids, vectors) in self.index.items()}
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        vec = np.asarray(embedding, dtype=np.float32)
+        return vec / (np.linalg.norm(vec) or 1.0)
+
+    def _remove(self, row_ids: list[int]):
+        if not row_ids:
+            return
+        self.conn.executemany("DELETE FROM answer_cache WHERE id = ?", [(i,) for i in row_ids])
+        self.conn.commit()
+        drop = set(row_ids)
+        for model, (ids, matrix) in list(self.index.items()):
+            keep = [k for k, i in enumerate(ids) if i not in drop]
+            if len(keep) == len(ids):
+                continue
+            self.index[model] = ([ids[k] for k in keep], matrix[keep])
+            if not keep:
+                del self.index[model]
+
+    def get(self, embedding, model: str):
+        """返回 (payload, 相似度)，未命中返回 None"""
+        if embedding is None:
+            return None
+        vec = self._normalize(embedding)
+        now = time.time()
+        with self.lock:
+            ids, matrix = self.index.get(model, ([], None))
+            if not ids or matrix.shape[1] != vec.shape[0]:
+                self.misses += 1
+                return None
+            sims = matrix @ vec
+            best = int(np.argmax(sims))
+            if sims[best] < self.threshold:
+                self.misses += 1
+                return None
+
+            row_id = ids[best]
+            payload, files, created_at = self.conn.execute(
+                "SELECT payload, files, created_at FROM answer_cache WHERE id = ?", (row_id,)).fetchone()
+            stale = now - created_at > self.ttl or any(
+                file_fingerprint(name, self.policy_dir) != fp for name, fp in json.loads(files).items())
+            if stale:
+                self._remove([row_id])
+                self.misses += 1
+                return None
+
+            self.conn.execute("UPDATE answer_cache SET accessed_at = ? WHERE id = ?", (now, row_id))
+            self.conn.commit()
+            self.hits += 1
+        return json.loads(payload), float(sims[best])
+
+    def put(self, question: str, embedding, model: str, payload: dict, cited_files: list[str]):
+        if embedding is None:
+            return
+        vec = self._normalize(embedding)
+        files = {name: file_fingerprint(name, self.policy_dir) for name in set(cited_files)}
+        now = time.time()
+        with self.lock:
+            cur = self.conn.execute(
+                "INSERT INTO answer_cache (model, question, embedding, payload, files, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (model, question, vec.tobytes(), json.dumps(payload, ensure_ascii=False),
+                 json.dumps(files, ensure_ascii=False), now, now))
+            self.conn.commit()
+            ids, matrix = self.index.get(model, ([], np.empty((0, vec.shape[0]), dtype=np.float32)))
+            self.index[model] = (ids + [cur.lastrowid], np.vstack([matrix, vec]))
+
+            overflow = self.conn.execute("SELECT COUNT(*) FROM answer_cache").fetchone()[0] - self.max_entries
+            if overflow > 0:
+                old = self.conn.execute("SELECT id FROM answer_cache ORDER BY accessed_at LIMIT ?", (overflow,))
+                self._remove([row[0] for row in old.fetchall()])
+
+    def invalidate_file(self, filename: str):
+        """主动失效引用了某个政策文件的所有条目（上传覆盖 / 删除 / 重新解析文件时调用）"""
+        with self.lock:
+            rows = self.conn.execute("SELECT id, files FROM answer_cache").fetchall()
+            self._remove([row_id for row_id, files in rows if filename in json.loads(files)])
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM answer_cache")
+            self.conn.commit()
+            self.index = {}
+
+    def stats(self) -> dict:
+        with self.lock:
+            size = sum(len(ids) for ids, _ in self.index.values())
+        return {"entries": size, "hits": self.hits, "misses": self.misses}
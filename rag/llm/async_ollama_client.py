@@ -0,0 +1,160 @@
+import asyncio
+import json
+import time
+from typing import AsyncGenerator
+
+import httpx
+
+from rag.llm.ollama_client import BaseOllamaClient, DEFAULT_TIMEOUT, RETRY_STATUS, NO_READ_RETRY, \
+    KEYWORD_PROMPT, STREAM_ERROR_PREFIX
+from rag.llm.scheduler import LLMScheduler, request_key, PRIORITY_ANSWER, PRIORITY_KEYWORDS, PRIORITY_BATCH
+
+
+class AsyncOllamaClient(BaseOllamaClient):
+    """基于 httpx.AsyncClient 的异步客户端，接口与 OllamaClient 一致，供 FastAPI websocket 等协程直接 await"""
+
+    def __init__(self, config, scheduler: LLMScheduler = None):
+        super().__init__(config, scheduler)
+        self.client = httpx.AsyncClient(
+            base_url=self.base_url,
+            limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size)
+        )
+
+    def _timeout(self, endpoint: str) -> httpx.Timeout:
+        connect, read = self.timeouts.get(endpoint, DEFAULT_TIMEOUT)
+        return httpx.Timeout(read, connect=connect)
+
+    async def _post(self, endpoint: str, payload: dict, stream: bool = False) -> httpx.Response:
+        """
+        带抖动指数退避的 POST，仅对连接失败/超时/429/5xx 重试（NO_READ_RETRY 中的接口读超时直接失败）；
+        stream=True 时需调用方 aclose()
+        """
+        for attempt in range(self.retries + 1):
+            self._count("requests")
+            try:
+                request = self.client.build_request("POST", endpoint, json=payload, timeout=self._timeout(endpoint))
+                response = await self.client.send(request, stream=stream)
+                if response.status_code not in RETRY_STATUS or attempt == self.retries:
+                    if response.is_error:
+                        await response.aread()
+                        await response.aclose()
+                    response.raise_for_status()
+                    return response
+                await response.aclose()
+            except httpx.ReadTimeout:
+                if endpoint in NO_READ_RETRY or attempt == self.retries:
+                    self._count("failures")
+                    raise
+            except (httpx.TransportError, httpx.TimeoutException):
+                if attempt == self.retries:
+                    self._count("failures")
+                    raise
+            except httpx.HTTPError:
+                self._count("failures")
+                raise
+
+            self._count("retries")
+            await asyncio.sleep(self._backoff_delay(attempt))
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    async def warm_up(self, role: str):
+        """预热模型（加载进显存/内存），按批量任务优先级排队"""
+        endpoint, payload = self._warmup_request(role)
+        await self._send_request(endpoint, payload, PRIORITY_BATCH)
+
+    async def loaded_models(self) -> dict:
+        """Ollama 当前已加载的模型：{模型名: 过期时间}"""
+        response = await self.client.get("/api/ps", timeout=self._timeout("/api/ps"))
+        response.raise_for_status()
+        return {m["name"]: m.get("expires_at") for m in response.json().get("models", [])}
+
+    async def _send_request(self, endpoint: str, payload: dict, priority: int = PRIORITY_BATCH) -> dict:
+        """经调度器排队发送，相同的在途请求合并为一次"""
+        return await self.scheduler.arun(request_key(endpoint, payload), payload["model"], priority,
+                                         lambda: self._request_json(endpoint, payload))
+
+    async def _request_json(self, endpoint: str, payload: dict) -> dict:
+        try:
+            response = await self._post(endpoint, payload)
+            return response.json()
+        except httpx.HTTPError as e:
+            raise Exception(f"Ollama API请求失败: {str(e)}")
+
+    # 嵌入模型接口
+    async def get_embeddings(self, texts: list[str], batch_size: int = None, concurrency: int = None,
+                             callback=None, priority: int = PRIORITY_BATCH) -> list[list[float]]:
+        """获取批量文本嵌入向量，输出与输入顺序一一对应（失败的条目为 None），并发数受 `concurrency` 限制"""
+        if not texts:
+            return []
+        semaphore = asyncio.Semaphore(concurrency or self.embed_concurrency)
+        embeddings = [None] * len(texts)
+        progress = {"done": 0, "failed": 0}
+        start = time.time()
+
+        async def run(i, batch):
+            async with semaphore:
+                try:
+                    embeddings[i:i + len(batch)] = await self._embed(batch, priority)
+                except Exception as e:
+                    progress["failed"] += len(batch)
+                    print(f"⚠️ 嵌入失败（第 {i}~{i + len(batch) - 1} 条）: {e}")
+            progress["done"] += len(batch)
+            self._embed_progress(callback, progress["done"], len(texts), start)
+
+        await asyncio.gather(*[run(i, batch) for i, batch in self._embed_jobs(texts, batch_size or self.embed_batch_size)])
+
+        if progress["failed"]:
+            print(f"⚠️ 共 {progress['failed']}/{len(texts)} 条文本嵌入失败，对应位置为 None")
+        return embeddings
+
+    async def _embed(self, batch: list[str], priority: int = PRIORITY_BATCH) -> list[list[float]]:
+        if self.embed_batch_api:
+            result = await self._send_request("/api/embed", self._embed_batch_payload(batch), priority)
+            return self._embed_result(result, len(batch))
+        result = await self._send_request("/api/embeddings", self._embedding_payload(batch[0]), priority)
+        return self._embed_result(result, 1)
+
+    # 视觉模型接口
+    async def describe_image(self, image_path: str, lang: str = "zh") -> str:
+        """解析图像内容"""
+        payload = await asyncio.to_thread(self._image_payload, image_path, lang)
+        result = await self._send_request("/api/generate", payload)
+        return result.get("response", "")
+
+    # 对话模型接口
+    async def generate_response(
+            self,
+            context: str,
+            question: str,
+            stream: bool = False,
+            priority: int = PRIORITY_ANSWER
+    ) -> AsyncGenerator[str, None] | str:
+        """生成政策咨询回答；stream=True 时返回异步生成器"""
+        payload = self._generate_payload(context, question, stream)
+
+        if stream:
+            return self._stream_generation(payload, priority)
+        else:
+            result = await self._send_request("/api/generate", payload, priority)
+            return result.get("response", "")
+
+    async def _stream_generation(self, payload: dict, priority: int = PRIORITY_ANSWER) -> AsyncGenerator[str, None]:
+        """处理流式响应（整个流式输出期间占用一个调度名额）"""
+        try:
+            async with self.scheduler.aslot(payload["model"], priority):
+                response = await self._post("/api/generate", payload, stream=True)
+                try:
+                    async for line in response.aiter_lines():
+                        if line:
+                            yield json.loads(line).get("response", "")
+                finally:
+                    await response.aclose()
+        except Exception as e:
+            yield f"{STREAM_ERROR_PREFIX}{str(e)}"
+
+    async def extract_keywords(self, question: str) -> tuple[list[str], dict[str, list[str]]]:
+        response = await self.generate_response(context="", question=KEYWORD_PROMPT.format(question=question),
+                                                stream=False, priority=PRIORITY_KEYWORDS)
+        return self._parse_keywords(response)
@@ -10,5 +10,63 @@ OLLAMA_CONFIG = {
         "chat": "deepseek-r1:7b",
         "embedding": "quentinz/bge-large-zh-v1.5",
         "cv": "llava"
+    },
+    # 连接池与超时（秒），超时按接口区分：(连接超时, 读取超时)
+    "pool_size": 8,
+    "timeouts": {
+        "/api/generate": (5, 300),
+        "/api/embeddings": (5, 30),
+        "/api/embed": (5, 120),
+    },
+    # 临时性错误（连接失败/超时/429/5xx）的重试次数与退避基数；/api/generate 读超时不重试（生成仍在进行，重发只会排队叠加）
+    "retries": 2,
+    "backoff": 0.5,
+    # 嵌入：embed_batch_api=True 使用 /api/embed 列表输入；False 时按单条 /api/embeddings 有界并发请求
+    "embed_batch_api": True,
+    "embed_batch_size": 32,
+    "embed_concurrency": 4,
+    # 每个模型同时在途的请求上限（按模型角色配置，未列出的模型使用 default），超出的请求按优先级排队
+    "max_in_flight": {
+        "chat": 1,
+        "embedding": 4,
+        "cv": 1,
+        "default": 2
+    },
+    # 模型在 Ollama 中的驻留时间（每次请求都会重置），按模型角色配置
+    "keep_alive": {
+        "chat": "30m",
+        "embedding": "30m",
+        "cv": "5m"
+    },
+    # 启动时预热的模型；空闲超过 idle_rewarm 秒后重新预热（应小于 keep_alive，避免模型被卸载）
+    "warmup": {
+        "roles": ["chat", "embedding"],
+        "idle_rewarm": 25 * 60,
+        "check_interval": 60
     }
-}
\ No newline at end of file
+}
+
+# LLM 关键词提取结果缓存（秒 / 条）
+KEYWORD_CACHE_CONFIG = {
+    "ttl": 7 * 24 * 3600,
+    "max_entries": 10000
+}
+
+# 语义答案缓存：问题嵌入余弦相似度阈值、过期秒数、最大条数
+ANSWER_CACHE_CONFIG = {
+    "threshold": 0.92,
+    "ttl": 7 * 24 * 3600,
+    "max_entries": 2000
+}
+
+# 引用高亮输出模式（见 rag/match.py 的 HIGHLIGHT_MODES）：
+# "image" 为整页 JPEG，"pdf" 为带高亮注释的单页 PDF（前端用内嵌阅读器打开）
+HIGHLIGHT_CONFIG = {
+    "mode": "image"
+}
+
+# LLM 上下文打包：检索文段的 token 预算（控制 CPU 上的 prefill 耗时）与首尾重叠判定的最小字符数
+CONTEXT_CONFIG = {
+    "max_tokens": 2048,
+    "min_overlap": 10
+}
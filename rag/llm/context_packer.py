@@ -0,0 +1,100 @@
+import re
+
+POSITION_TAG_RE = re.compile(r"@@[\t0-9.-]+?##")
+CJK_RE = re.compile(r"[\u3000-\u303f\u4e00-\u9fff\uff00-\uffef]")
+SENTENCE_END_RE = re.compile(r"(?<=[。！？；\n])")
+
+
+def strip_position_tags(text: str) -> str:
+    """去掉 `@@页码\tx0\tx1\ty0\ty1##` 坐标标签"""
+    return re.sub(r"[ \t]+", " ", POSITION_TAG_RE.sub("", text)).strip()
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    快速估算 token 数：中文字符 / 全角标点按 1 个 token，其余字符按 4 个字符 1 个 token
+    （对 deepseek / qwen 一类分词器偏保守，宁可少放也不超预算）
+    """
+    cjk = len(CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def _overlap(a: str, b: str, min_overlap: int) -> int:
+    """a 的后缀与 b 的前缀的最长重叠长度（不足 min_overlap 视为 0）"""
+    for n in range(min(len(a), len(b)), min_overlap - 1, -1):
+        if a.endswith(b[:n]):
+            return n
+    return 0
+
+
+class ContextPacker:
+    """
+    把检索结果装进 LLM 上下文：
+    1. 去掉坐标标签
+    2. 同一文件内，被包含的文段丢弃，首尾重叠的文段拼接成一段
+    3. 按分数从高到低，在 `max_tokens` 预算内依次放入，最后一段放不下时按句截断
+    - `tokenizer`: 可选，返回 token 列表的函数（如 HuggingFace tokenizer.encode），默认使用 estimate_tokens 近似
+    """
+
+    def __init__(self, max_tokens=2048, tokenizer=None, min_overlap=10):
+        self.max_tokens = max_tokens
+        self.min_overlap = min_overlap
+        self.count_tokens = (lambda text: len(tokenizer(text))) if tokenizer else estimate_tokens
+
+    def passages(self, search_results: list[dict]) -> list[dict]:
+        """去标签、去重叠，返回按分数降序的 [{"文件", "内容", "分数"}]"""
+        by_file = {}
+        for res in search_results:
+            for text, score in res["相关内容"]:
+                text = strip_position_tags(text)
+                if text:
+                    by_file.setdefault(res["文件"], []).append({"文件": res["文件"], "内容": text, "分数": score})
+
+        passages = []
+        for items in by_file.values():
+            merged = []
+            for item in sorted(items, key=lambda p: p["分数"], reverse=True):
+                for kept in merged:
+                    if item["内容"] in kept["内容"]:
+                        break
+                    if kept["内容"] in item["内容"]:
+                        kept["内容"] = item["内容"]
+                        break
+                    n = _overlap(kept["内容"], item["内容"], self.min_overlap)
+                    if n:
+                        kept["内容"] += item["内容"][n:]
+                        break
+                    n = _overlap(item["内容"], kept["内容"], self.min_overlap)
+                    if n:
+                        kept["内容"] = item["内容"] + kept["内容"][n:]
+                        break
+                else:
+                    merged.append(dict(item))
+            passages.extend(merged)
+
+        return sorted(passages, key=lambda p: p["分数"], reverse=True)
+
+    def _truncate(self, text: str, budget: int) -> str:
+        """按句截断到 budget 以内，一句都放不下时返回空串"""
+        out = ""
+        for sentence in SENTENCE_END_RE.split(text):
+            if self.count_tokens(out + sentence) > budget:
+                break
+            out += sentence
+        return out
+
+    def pack(self, search_results: list[dict]) -> str:
+        blocks = []
+        used = 0
+        for p in self.passages(search_results):
+            header = f"📄 文件: {p['文件']} (相关性: {round(p['分数'], 3)})\n"
+            cost = self.count_tokens(header + p["内容"]) + 1
+            if used + cost <= self.max_tokens:
+                blocks.append(header + p["内容"])
+                used += cost
+                continue
+            text = self._truncate(p["内容"], self.max_tokens - used - self.count_tokens(header) - 1)
+            if text:
+                blocks.append(header + text)
+            break
+        return "\n\n".join(blocks)
@@ -0,0 +1,111 @@
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+
+from rag.nlp import rag_tokenizer
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+CACHE_FILE = os.path.join(BASE_DIR, "res", "keyword_cache.db")
+
+
+def normalize_question(question: str) -> str:
+    """归一化问题：全角转半角、小写、繁转简，去掉空白与句末标点"""
+    q = rag_tokenizer.tradi2simp(rag_tokenizer.strQ2B(question).lower())
+    return re.sub(r"[\s?？!！。.~]+$", "", re.sub(r"\s+", " ", q).strip())
+
+
+class KeywordCache:
+    """
+    LLM 关键词 / 近义词提取结果的持久化缓存（sqlite）
+    - key: (归一化问题, 模型名)
+    - value: (keywords, synonyms)
+    - `ttl`: 过期秒数；`max_entries`: 超出时按最近访问时间淘汰
+    """
+
+    def __init__(self, path=CACHE_FILE, ttl=7 * 24 * 3600, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS keyword_cache (
+                question TEXT NOT NULL,
+                model TEXT NOT NULL,
+                keywords TEXT NOT NULL,
+                synonyms TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                PRIMARY KEY (question, model)
+            )""")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_accessed ON keyword_cache (accessed_at)")
+        self.conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, question: str, model: str):
+        key = normalize_question(question)
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT keywords, synonyms, created_at FROM keyword_cache WHERE question = ? AND model = ?",
+                (key, model)).fetchone()
+            if row and now - row[2] > self.ttl:
+                self.conn.execute("DELETE FROM keyword_cache WHERE question = ? AND model = ?", (key, model))
+                self.conn.commit()
+                row = None
+            if not row:
+                self.misses += 1
+                return None
+            self.conn.execute("UPDATE keyword_cache SET accessed_at = ? WHERE question = ? AND model = ?",
+                              (now, key, model))
+            self.conn.commit()
+            self.hits += 1
+        return json.loads(row[0]), json.loads(row[1])
+
+    def put(self, question: str, model: str, keywords: list[str], synonyms: dict[str, list[str]]):
+        key = normalize_question(question)
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO keyword_cache VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, json.dumps(keywords, ensure_ascii=False), json.dumps(synonyms, ensure_ascii=False),
+                 now, now))
+            overflow = self.conn.execute("SELECT COUNT(*) FROM keyword_cache").fetchone()[0] - self.max_entries
+            if overflow > 0:
+                self.conn.execute(
+                    "DELETE FROM keyword_cache WHERE rowid IN "
+                    "(SELECT rowid FROM keyword_cache ORDER BY accessed_at LIMIT ?)", (overflow,))
+            self.conn.commit()
+
+    def purge_expired(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM keyword_cache WHERE created_at < ?", (time.time() - self.ttl,))
+            self.conn.commit()
+
+    def stats(self) -> dict:
+        with self.lock:
+            size = self.conn.execute("SELECT COUNT(*) FROM keyword_cache").fetchone()[0]
+        return {"entries": size, "hits": self.hits, "misses": self.misses}
+
+
+def warm_from_log(log_path: str):
+    """从问题日志（每行一个问题）预热缓存，已缓存的问题跳过"""
+    from rag.inference import extract_keywords, keyword_cache, client
+
+    with open(log_path, "r", encoding="utf-8") as f:
+        questions = list(dict.fromkeys(line.strip() for line in f if line.strip()))
+
+    warmed = 0
+    for question in questions:
+        if keyword_cache.get(question, client.models["chat"]) is None:
+            extract_keywords(question, use_llm=True)
+            warmed += 1
+    print(f"✅ 关键词缓存预热完成：{len(questions)} 个问题，新增 {warmed} 条，{keyword_cache.stats()}")
+
+
+if __name__ == "__main__":
+    warm_from_log(sys.argv[1])
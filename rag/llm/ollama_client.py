@@ -1,28 +1,79 @@
+import random
 import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import requests
+from requests.adapters import HTTPAdapter
 import base64
 from typing import Generator
 from PIL import Image
 from io import BytesIO
 import json
 
-class OllamaClient:
-    def __init__(self, config):
+from rag.llm.scheduler import LLMScheduler, request_key, PRIORITY_ANSWER, PRIORITY_KEYWORDS, PRIORITY_BATCH
+
+DEFAULT_TIMEOUT = (5, 60)
+RETRY_STATUS = {429, 500, 502, 503, 504}
+# 生成类接口读超时不重试：请求已送达，Ollama 仍在生成，重发只会在同一模型上叠加一份完整生成
+NO_READ_RETRY = {"/api/generate"}
+# 流式生成失败时在流末尾输出的提示前缀（调用方据此判断生成是否成功）
+STREAM_ERROR_PREFIX = "流式生成错误: "
+
+
+KEYWORD_PROMPT = """用户正在进行学校政策文件提问，请从以下问题中提取最重要的关键词（2-3字，只有专有名词可为4字以上），用于后续文档检索。
+同时，为了提高搜索效果，请参考 `jieba` 词库，为每个关键词提供 1-2 个近义词。
+关键词应避免单字，常见词汇无需提取。近义词若没有，可以不提供。
+  
+**示例 1：**
+- 输入："推免的年级排名应为多少？"
+- 关键词提取："推免 年级 排名"
+- 近义词扩展："推免|保研 年级|年段 排名|排名要求"
+
+**示例 2：**
+- 输入："保研的英语要求是什么？雅思 5 分可以吗？"
+- 关键词提取："保研 英语 雅思"
+- 近义词扩展："保研|推免 英语|外语 雅思|雅思考试"
+
+请严格按照以下格式返回：
+---
+关键词：关键词1 关键词2 关键词3
+近义词：关键词1|近义词A 关键词2|近义词B 关键词3|近义词C
+---
+  
+请处理以下用户问题：
+问题：{question}
+"""
+
+
+class BaseOllamaClient:
+    """同步/异步客户端共用的配置与请求体构造、结果解析"""
+
+    def __init__(self, config, scheduler: LLMScheduler = None):
         self.base_url = config["base_url"]
         self.models = config["models"]
+        self.timeouts = config.get("timeouts", {})
+        self.retries = config.get("retries", 2)
+        self.backoff = config.get("backoff", 0.5)
+        self.pool_size = config.get("pool_size", 8)
+        self.embed_batch_api = config.get("embed_batch_api", True)
+        self.embed_batch_size = config.get("embed_batch_size", 32)
+        self.embed_concurrency = config.get("embed_concurrency", 4)
+        self.keep_alive = {self.models[role]: value for role, value in config.get("keep_alive", {}).items()
+                           if role in self.models}
+        # 同步/异步客户端传入同一个调度器，才能共享每个模型的在途上限
+        self.scheduler = scheduler or LLMScheduler.from_config(config)
 
-    def _send_request(self, endpoint: str, payload: dict) -> dict:
-        try:
-            response = requests.post(
-                f"{self.base_url}{endpoint}",
-                json=payload,
-                timeout=60
-            )
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            raise Exception(f"Ollama API请求失败: {str(e)}")
+        self._metrics_lock = threading.Lock()
+        self.metrics = {"requests": 0, "retries": 0, "failures": 0}
+
+    def _count(self, key: str):
+        with self._metrics_lock:
+            self.metrics[key] += 1
+
+    def _backoff_delay(self, attempt: int) -> float:
+        return self.backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
 
     def _image_to_base64(self, image_path: str) -> str:
         with Image.open(image_path) as img:
@@ -30,47 +81,59 @@ class OllamaClient:
             img.save(buffered, format="PNG")
             return base64.b64encode(buffered.getvalue()).decode("utf-8")
 
-    # 嵌入模型接口
-    def get_embeddings(self, texts: list[str]) -> list[list[float]]:
-        """获取批量文本嵌入向量"""
-        payload = {
+    def _with_keep_alive(self, payload: dict) -> dict:
+        """按模型附加 keep_alive（未配置时使用 Ollama 默认的 5 分钟）"""
+        if payload["model"] in self.keep_alive:
+            payload["keep_alive"] = self.keep_alive[payload["model"]]
+        return payload
+
+    def _embedding_payload(self, text: str) -> dict:
+        return self._with_keep_alive({
             "model": self.models["embedding"],
-            "prompt": texts[0],  # 新模型要求单条输入
+            "prompt": text,  # 新模型要求单条输入
             "options": {"embedding_only": True}
-        }
-        # 批量处理逻辑需要改为循环
-        embeddings = []
-        for text in texts:
-            payload["prompt"] = text
-            result = self._send_request("/api/embeddings", payload)
-            if "embedding" in result:
-                embeddings.append(result["embedding"])
+        })
+
+    def _embed_batch_payload(self, texts: list[str]) -> dict:
+        return self._with_keep_alive({"model": self.models["embedding"], "input": texts})
+
+    def _warmup_request(self, role: str) -> tuple[str, dict]:
+        """预热请求：对话/视觉模型发送空 prompt 只加载不生成，嵌入模型嵌入一条短文本"""
+        if role == "embedding":
+            return "/api/embed", self._embed_batch_payload(["预热"])
+        return "/api/generate", self._with_keep_alive({"model": self.models[role], "prompt": "", "stream": False})
+
+    def _embed_jobs(self, texts: list[str], batch_size: int) -> list[tuple[int, list[str]]]:
+        """按模式切分任务：(起始下标, 文本列表)"""
+        if not self.embed_batch_api:
+            batch_size = 1
+        return [(i, texts[i:i + batch_size]) for i in range(0, len(texts), batch_size)]
+
+    def _embed_result(self, result: dict, n: int) -> list[list[float]]:
+        embeddings = result.get("embeddings") or ([result["embedding"]] if "embedding" in result else [])
+        if len(embeddings) != n:
+            raise Exception(f"嵌入结果数量不符: 期望 {n}，实际 {len(embeddings)}")
         return embeddings
 
-    # 视觉模型接口
-    def describe_image(self, image_path: str, lang: str = "zh") -> str:
-        """解析图像内容"""
+    @staticmethod
+    def _embed_progress(callback, done: int, total: int, start: float):
+        if callback:
+            speed = done / max(time.time() - start, 1e-6)
+            callback(prog=done / total, msg=f"嵌入 {done}/{total} 条，{speed:.1f} 条/秒")
+
+    def _image_payload(self, image_path: str, lang: str) -> dict:
         base64_image = self._image_to_base64(image_path)
         prompt = "请用中文详细描述图片中的内容，包括文字、图表、数据等所有可见信息" if lang == "zh" else \
             "Describe the image content in detail including text, charts, data, etc."
 
-        payload = {
+        return self._with_keep_alive({
             "model": self.models["cv"],
             "prompt": prompt,
             "images": [base64_image],
             "stream": False
-        }
-        result = self._send_request("/api/generate", payload)
-        return result.get("response", "")
+        })
 
-    # 对话模型接口
-    def generate_response(
-            self,
-            context: str,
-            question: str,
-            stream: bool = False
-    ) -> Generator[str, None, None] | str:
-        """生成政策咨询回答"""
+    def _generate_payload(self, context: str, question: str, stream: bool) -> dict:
         system_prompt = f"""你是一个专业的学校政策咨询助手，请严格根据提供的上下文信息回答问题。
 
         上下文内容：
@@ -84,7 +147,7 @@ class OllamaClient:
         5. 如没有政策符合提问，则输出“并未查询到相关政策，无法作答”
 """
 
-        payload = {
+        return self._with_keep_alive({
             "model": self.models["chat"],
             "system": system_prompt,
             "prompt": question,
@@ -94,59 +157,10 @@ class OllamaClient:
                 "top_p": 0.9,
                 "max_tokens": 1024
             }
-        }
-
-        if stream:
-            return self._stream_generation(payload)
-        else:
-            result = self._send_request("/api/generate", payload)
-            return result.get("response", "")
-
-    def _stream_generation(self, payload: dict) -> Generator[str, None, None]:
-        """处理流式响应"""
-        try:
-            with requests.post(
-                f"{self.base_url}/api/generate",
-                json=payload,
-                stream=True,
-                timeout=60
-            ) as response:
-                response.raise_for_status()
-                for line in response.iter_lines():
-                    if line:
-                        chunk = json.loads(line.decode("utf-8"))  # <-- 需要json模块
-                        yield chunk.get("response", "")
-        except Exception as e:
-            yield f"流式生成错误: {str(e)}"
-
-    import re
-
-    def extract_keywords(self, question: str) -> tuple[list[str], dict[str, list[str]]]:
-        prompt = f"""用户正在进行学校政策文件提问，请从以下问题中提取最重要的关键词（2-3字，只有专有名词可为4字以上），用于后续文档检索。
-同时，为了提高搜索效果，请参考 `jieba` 词库，为每个关键词提供 1-2 个近义词。
-关键词应避免单字，常见词汇无需提取。近义词若没有，可以不提供。
-  
-**示例 1：**
-- 输入："推免的年级排名应为多少？"
-- 关键词提取："推免 年级 排名"
-- 近义词扩展："推免|保研 年级|年段 排名|排名要求"
-
-**示例 2：**
-- 输入："保研的英语要求是什么？雅思 5 分可以吗？"
-- 关键词提取："保研 英语 雅思"
-- 近义词扩展："保研|推免 英语|外语 雅思|雅思考试"
-
-请严格按照以下格式返回：
----
-关键词：关键词1 关键词2 关键词3
-近义词：关键词1|近义词A 关键词2|近义词B 关键词3|近义词C
----
-  
-请处理以下用户问题：
-问题：{question}
-"""
-        response = self.generate_response(context="", question=prompt, stream=False)
+        })
 
+    @staticmethod
+    def _parse_keywords(response: str) -> tuple[list[str], dict[str, list[str]]]:
         # 处理 LLM 可能的 <think> 结构
         cleaned_response = re.sub(r"<think>.*?</think>", "", response, flags=re.DOTALL).strip()
 
@@ -171,3 +185,167 @@ class OllamaClient:
 
         return keywords, synonyms
 
+
+class OllamaClient(BaseOllamaClient):
+    def __init__(self, config, scheduler: LLMScheduler = None):
+        super().__init__(config, scheduler)
+
+        # 共享 keep-alive 连接池，所有请求复用 TCP 连接
+        pool_size = self.pool_size
+        self.session = requests.Session()
+        self._adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", self._adapter)
+        self.session.mount("https://", self._adapter)
+
+    def _post(self, endpoint: str, payload: dict, stream: bool = False, timeout: float = None) -> requests.Response:
+        """
+        带抖动指数退避的 POST，仅对连接失败/超时/429/5xx 重试（NO_READ_RETRY 中的接口读超时直接失败）
+        - `timeout`: 本次调用的读超时（秒），覆盖配置中该接口的读超时
+        """
+        connect, read = self.timeouts.get(endpoint, DEFAULT_TIMEOUT)
+        if timeout is not None:
+            connect, read = min(connect, timeout), timeout
+        for attempt in range(self.retries + 1):
+            self._count("requests")
+            try:
+                response = self.session.post(
+                    f"{self.base_url}{endpoint}",
+                    json=payload,
+                    stream=stream,
+                    timeout=(connect, read)
+                )
+                if response.status_code not in RETRY_STATUS or attempt == self.retries:
+                    response.raise_for_status()
+                    return response
+                response.close()
+            except requests.exceptions.ReadTimeout:
+                if endpoint in NO_READ_RETRY or attempt == self.retries:
+                    self._count("failures")
+                    raise
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if attempt == self.retries:
+                    self._count("failures")
+                    raise
+            except requests.exceptions.RequestException:
+                self._count("failures")
+                raise
+
+            self._count("retries")
+            time.sleep(self._backoff_delay(attempt))
+
+    def connection_stats(self) -> dict:
+        """连接复用统计：请求数、新建 TCP 连接数与复用率"""
+        pools = self._adapter.poolmanager.pools
+        connections = sum(pools[key].num_connections for key in pools.keys())
+        with self._metrics_lock:
+            stats = dict(self.metrics)
+        stats["connections"] = connections
+        stats["reuse_ratio"] = round(1 - connections / stats["requests"], 3) if stats["requests"] else 0.0
+        return stats
+
+    def close(self):
+        self.session.close()
+
+    def _send_request(self, endpoint: str, payload: dict, priority: int = PRIORITY_BATCH,
+                      timeout: float = None) -> dict:
+        """
+        经调度器排队发送，相同的在途请求合并为一次
+        - `timeout`: 排队 + 请求的总时限（秒），超过时抛出 TimeoutError
+        """
+        key = request_key(endpoint, payload)
+        if timeout is None:
+            return self.scheduler.run(key, payload["model"], priority, lambda: self._request_json(endpoint, payload))
+        # 排队已用掉的时间从请求的读超时中扣除
+        deadline = time.monotonic() + timeout
+        return self.scheduler.run(key, payload["model"], priority, lambda: self._request_json(
+            endpoint, payload, max(deadline - time.monotonic(), 0.1)), timeout)
+
+    def _request_json(self, endpoint: str, payload: dict, timeout: float = None) -> dict:
+        try:
+            with self._post(endpoint, payload, timeout=timeout) as response:
+                return response.json()
+        except requests.exceptions.ReadTimeout as e:
+            if timeout is not None:  # 调用方自己的时限：作为 TimeoutError 抛出，合并的跟随者会重新发起
+                raise TimeoutError(f"Ollama 在 {timeout:.1f}s 内未返回") from e
+            raise Exception(f"Ollama API请求失败: {str(e)}")
+        except requests.exceptions.RequestException as e:
+            raise Exception(f"Ollama API请求失败: {str(e)}")
+
+    # 嵌入模型接口
+    def get_embeddings(self, texts: list[str], batch_size: int = None, concurrency: int = None,
+                       callback=None, priority: int = PRIORITY_BATCH) -> list[list[float]]:
+        """
+        获取批量文本嵌入向量，输出与输入顺序一一对应（失败的条目为 None）
+        - `batch_size`: /api/embed 每批条数
+        - `concurrency`: 同时提交的请求数（实际在途数还受调度器的模型上限约束）
+        - `callback(prog=, msg=)`: 进度与吞吐回调
+        - `priority`: 调度优先级，在线问答的问题嵌入应使用 PRIORITY_ANSWER
+        """
+        if not texts:
+            return []
+        jobs = self._embed_jobs(texts, batch_size or self.embed_batch_size)
+        embeddings = [None] * len(texts)
+        done, failed, start = 0, 0, time.time()
+
+        with ThreadPoolExecutor(max_workers=concurrency or self.embed_concurrency) as executor:
+            futures = {executor.submit(self._embed, batch, priority): (i, len(batch)) for i, batch in jobs}
+            for future in as_completed(futures):
+                i, n = futures[future]
+                try:
+                    embeddings[i:i + n] = future.result()
+                except Exception as e:
+                    failed += n
+                    print(f"⚠️ 嵌入失败（第 {i}~{i + n - 1} 条）: {e}")
+                done += n
+                self._embed_progress(callback, done, len(texts), start)
+
+        if failed:
+            print(f"⚠️ 共 {failed}/{len(texts)} 条文本嵌入失败，对应位置为 None")
+        return embeddings
+
+    def _embed(self, batch: list[str], priority: int = PRIORITY_BATCH) -> list[list[float]]:
+        if self.embed_batch_api:
+            result = self._send_request("/api/embed", self._embed_batch_payload(batch), priority)
+            return self._embed_result(result, len(batch))
+        return self._embed_result(self._send_request("/api/embeddings", self._embedding_payload(batch[0]), priority), 1)
+
+    # 视觉模型接口
+    def describe_image(self, image_path: str, lang: str = "zh") -> str:
+        """解析图像内容"""
+        result = self._send_request("/api/generate", self._image_payload(image_path, lang))
+        return result.get("response", "")
+
+    # 对话模型接口
+    def generate_response(
+            self,
+            context: str,
+            question: str,
+            stream: bool = False,
+            priority: int = PRIORITY_ANSWER,
+            timeout: float = None
+    ) -> Generator[str, None, None] | str:
+        """生成政策咨询回答（`timeout` 仅对非流式生效：排队 + 生成的总时限，超过时抛出 TimeoutError）"""
+        payload = self._generate_payload(context, question, stream)
+
+        if stream:
+            return self._stream_generation(payload, priority)
+        else:
+            result = self._send_request("/api/generate", payload, priority, timeout)
+            return result.get("response", "")
+
+    def _stream_generation(self, payload: dict, priority: int = PRIORITY_ANSWER) -> Generator[str, None, None]:
+        """处理流式响应（整个流式输出期间占用一个调度名额）"""
+        try:
+            with self.scheduler.slot(payload["model"], priority), \
+                    self._post("/api/generate", payload, stream=True) as response:
+                for line in response.iter_lines():
+                    if line:
+                        chunk = json.loads(line.decode("utf-8"))  # <-- 需要json模块
+                        yield chunk.get("response", "")
+        except Exception as e:
+            yield f"{STREAM_ERROR_PREFIX}{str(e)}"
+
+    def extract_keywords(self, question: str, timeout: float = None) -> tuple[list[str], dict[str, list[str]]]:
+        response = self.generate_response(context="", question=KEYWORD_PROMPT.format(question=question), stream=False,
+                                          priority=PRIORITY_KEYWORDS, timeout=timeout)
+        return self._parse_keywords(response)
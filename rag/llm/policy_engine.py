@@ -1,10 +1,14 @@
 import numpy as np
 from typing import List
 
+from rag.llm.context_packer import ContextPacker
+
 
 class PolicyQAEngine:
-    def __init__(self, ollama_client):
+    def __init__(self, ollama_client, async_client=None, packer=None):
         self.client = ollama_client
+        self.async_client = async_client  # AsyncOllamaClient，供协程环境使用
+        self.packer = packer or ContextPacker()
         self.document_vectors = None
         self.documents = []
 
@@ -18,12 +22,29 @@ class PolicyQAEngine:
         if not search_results:
             return "❌ 无法找到相关政策，请尝试更具体的问题。"
 
-        # 格式化检索结果
-        formatted_docs = "\n\n".join([
-            f"📄 文件: {res['文件']} (相关性: {res['搜索分数']})\n" +
-            "\n".join([f"({round(sent[1], 2)}) {sent[0]}" for sent in res["相关内容"]])
-            for res in search_results
-        ])
+        # 让 DeepSeek 处理最终回答
+        answer = self.client.generate_response(
+            context=self.build_context(question, search_results),
+            question=question,
+            stream=stream
+        )
+
+        return answer
+
+    async def answer_question_async(self, question: str, search_results: List[dict], stream: bool = False):
+        """answer_question 的异步版本，不阻塞事件循环；stream=True 时返回异步生成器"""
+        if not search_results:
+            return "❌ 无法找到相关政策，请尝试更具体的问题。"
+
+        return await self.async_client.generate_response(
+            context=self.build_context(question, search_results),
+            question=question,
+            stream=stream
+        )
+
+    def build_context(self, question: str, search_results: List[dict]) -> str:
+        # 格式化检索结果（去坐标标签、去重叠，按 token 预算装入）
+        formatted_docs = self.packer.pack(search_results)
 
         # 组织 LLM 输入
         combined_question = (
@@ -33,12 +54,4 @@ class PolicyQAEngine:
             f"{question}\n\n"
             "请基于提供的政策文件回答问题，并确保答案准确。"
         )
-
-        # 让 DeepSeek 处理最终回答
-        answer = self.client.generate_response(
-            context=combined_question,
-            question=question,
-            stream=stream
-        )
-
-        return answer
\ No newline at end of file
+        return combined_question
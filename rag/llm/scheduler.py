@@ -0,0 +1,256 @@
+import asyncio
+import hashlib
+import heapq
+import itertools
+import json
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager, asynccontextmanager
+
+# 优先级：数值越小越先执行
+PRIORITY_ANSWER = 0  # 交互式回答
+PRIORITY_KEYWORDS = 1  # 关键词提取
+PRIORITY_BATCH = 2  # 批量任务（入库嵌入、图片解析等）
+PRIORITY_NAMES = {PRIORITY_ANSWER: "answer", PRIORITY_KEYWORDS: "keywords", PRIORITY_BATCH: "batch"}
+
+# 合并请求的执行方被取消时交给跟随者的结果：跟随者重新发起请求（其中一个成为新的执行方）
+_RETRY = object()
+
+
+def request_key(endpoint: str, payload: dict) -> str:
+    """相同接口 + 相同请求体视为同一请求，用于合并在途请求"""
+    raw = endpoint + json.dumps(payload, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "wake", "granted", "cancelled")
+
+    def __init__(self, priority, seq, wake):
+        self.priority = priority
+        self.seq = seq
+        self.wake = wake
+        self.granted = False
+        self.cancelled = False
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class _ModelGate:
+    """
+    单个模型的在途请求上限 + 优先级队列
+    - 同步线程与协程共用：线程用 Event 等待，协程用 loop 上的 Future 等待，不占用额外线程
+    - 释放名额时直接移交给队首（优先级最高、最早到达）的等待者
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_flight = 0
+        self.waiters = []
+        self.lock = threading.Lock()
+        self.seq = itertools.count()
+
+    def _enter(self, priority, wake):
+        """加锁调用：有空闲名额且无人排队时直接进入返回 None，否则入队返回 _Waiter"""
+        if self.in_flight < self.limit and not self.waiters:
+            self.in_flight += 1
+            return None
+        waiter = _Waiter(priority, next(self.seq), wake)
+        heapq.heappush(self.waiters, waiter)
+        return waiter
+
+    def acquire(self, priority: int, timeout: float = None) -> bool:
+        """排队获取名额，`timeout` 秒内未轮到时放弃排队并返回 False"""
+        event = threading.Event()
+        with self.lock:
+            waiter = self._enter(priority, event.set)
+        if waiter is None or event.wait(timeout):
+            return True
+        with self.lock:
+            waiter.cancelled = True
+            granted = waiter.granted
+        if granted:  # 超时的同时名额已移交过来，需要还回去
+            self.release()
+        return False
+
+    async def acquire_async(self, priority: int):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+        with self.lock:
+            waiter = self._enter(priority, wake)
+        if waiter is None:
+            return
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self.lock:
+                waiter.cancelled = True
+                granted = waiter.granted
+            if granted:  # 取消前名额已移交过来，需要还回去
+                self.release()
+            raise
+
+    def release(self):
+        with self.lock:
+            while self.waiters:
+                waiter = heapq.heappop(self.waiters)
+                if not waiter.cancelled:
+                    waiter.granted = True
+                    waiter.wake()
+                    return
+            self.in_flight -= 1
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"limit": self.limit, "in_flight": self.in_flight, "queued": len(self.waiters)}
+
+
+class LLMScheduler:
+    """
+    Ollama 请求调度：
+    - 每个模型限制同时在途的请求数（本地 Ollama 同时生成过多只会互相拖慢）
+    - 排队按优先级：交互式回答 > 关键词提取 > 批量任务
+    - 相同的非流式请求在途时合并到同一个 Future，只向 Ollama 发送一次；
+      执行方被取消（如关键词提取超过截止时间被放弃）时立即释放名额，跟随者重新发起而不是一起收到取消
+    - 统计各优先级的排队等待时间
+    """
+
+    def __init__(self, limits: dict[str, int] = None, default_limit: int = 2):
+        self.limits = limits or {}
+        self.default_limit = default_limit
+        self.gates = {}
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.coalesced = 0
+        self.last_active = {}  # model -> 最近一次请求结束的时间戳，用于空闲重新预热
+        self.waits = {name: {"count": 0, "total": 0.0, "max": 0.0} for name in PRIORITY_NAMES.values()}
+
+    @classmethod
+    def from_config(cls, config: dict):
+        """`max_in_flight` 按模型角色（chat / embedding / cv）配置，转换为按模型名限制"""
+        max_in_flight = config.get("max_in_flight", {})
+        limits = {}
+        for role, model in config["models"].items():
+            if role in max_in_flight:
+                limits[model] = min(limits.get(model, max_in_flight[role]), max_in_flight[role])
+        return cls(limits, max_in_flight.get("default", 2))
+
+    def _gate(self, model: str) -> _ModelGate:
+        with self.lock:
+            if model not in self.gates:
+                self.gates[model] = _ModelGate(self.limits.get(model, self.default_limit))
+            return self.gates[model]
+
+    def _record_wait(self, priority: int, seconds: float):
+        with self.lock:
+            stat = self.waits[PRIORITY_NAMES.get(priority, "batch")]
+            stat["count"] += 1
+            stat["total"] += seconds
+            stat["max"] = max(stat["max"], seconds)
+
+    @contextmanager
+    def slot(self, model: str, priority: int = PRIORITY_BATCH, timeout: float = None):
+        """占用一个模型名额，排队超过 `timeout` 秒时抛出 TimeoutError"""
+        gate = self._gate(model)
+        start = time.perf_counter()
+        acquired = gate.acquire(priority, timeout)
+        self._record_wait(priority, time.perf_counter() - start)
+        if not acquired:
+            raise TimeoutError(f"模型 {model} 排队超过 {timeout}s")
+        try:
+            yield
+        finally:
+            gate.release()
+            self.last_active[model] = time.time()
+
+    @asynccontextmanager
+    async def aslot(self, model: str, priority: int = PRIORITY_BATCH):
+        gate = self._gate(model)
+        start = time.perf_counter()
+        await gate.acquire_async(priority)
+        self._record_wait(priority, time.perf_counter() - start)
+        try:
+            yield
+        finally:
+            gate.release()
+            self.last_active[model] = time.time()
+
+    def _join(self, key: str):
+        """返回 (future, 是否由当前调用方执行)"""
+        with self.lock:
+            if key in self.pending:
+                self.coalesced += 1
+                return self.pending[key], False
+            future = self.pending[key] = Future()
+            return future, True
+
+    def _finish(self, key: str, future: Future, result=None, error: Exception = None):
+        with self.lock:
+            self.pending.pop(key, None)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def run(self, key: str, model: str, priority: int, func, timeout: float = None):
+        """
+        同步执行 func()，相同 key 的在途请求只执行一次
+        - `timeout`: 排队 / 等待合并结果的上限（秒），超时抛出 TimeoutError；func 自身的耗时由调用方限制
+        """
+        while True:
+            future, owner = self._join(key)
+            if not owner:
+                result = future.result(timeout)
+                if result is _RETRY:
+                    continue
+                return result
+            try:
+                with self.slot(model, priority, timeout):
+                    result = func()
+            except TimeoutError:  # 排队超时只属于执行方自己，跟随者重新发起
+                self._finish(key, future, _RETRY)
+                raise
+            except Exception as e:
+                self._finish(key, future, error=e)
+                raise
+            except BaseException:  # 中断 / 取消只属于执行方自己
+                self._finish(key, future, _RETRY)
+                raise
+            self._finish(key, future, result)
+            return result
+
+    async def arun(self, key: str, model: str, priority: int, coro_func):
+        """run 的协程版本，coro_func() 返回待 await 的协程"""
+        while True:
+            future, owner = self._join(key)
+            if not owner:
+                result = await asyncio.shield(asyncio.wrap_future(future))
+                if result is _RETRY:
+                    continue
+                return result
+            try:
+                async with self.aslot(model, priority):  # 被取消时退出 async with 即释放名额
+                    result = await coro_func()
+            except Exception as e:
+                self._finish(key, future, error=e)
+                raise
+            except BaseException:  # asyncio.CancelledError：不传给跟随者
+                self._finish(key, future, _RETRY)
+                raise
+            self._finish(key, future, result)
+            return result
+
+    def stats(self) -> dict:
+        with self.lock:
+            waits = {name: {"count": s["count"], "avg": round(s["total"] / s["count"], 4) if s["count"] else 0.0,
+                            "max": round(s["max"], 4)} for name, s in self.waits.items()}
+            gates = dict(self.gates)
+            coalesced = self.coalesced
+        return {"models": {model: gate.stats() for model, gate in gates.items()},
+                "queue_wait": waits, "coalesced": coalesced}
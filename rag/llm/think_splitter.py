@@ -0,0 +1,47 @@
+THINK_OPEN = "<think>"
+THINK_CLOSE = "</think>"
+
+
+class ThinkSplitter:
+    """
+    增量切分流式输出中的 <think>…</think>：
+    - feed(chunk) 返回 [("thinking" | "answer", 文本), ...]，可直接转发给前端
+    - 标签可能被拆在两个 chunk 之间，末尾可能是标签前缀的部分先缓存，等下一个 chunk 再判断
+    """
+
+    def __init__(self):
+        self.in_think = False
+        self.buffer = ""
+
+    def feed(self, chunk: str) -> list[tuple[str, str]]:
+        self.buffer += chunk
+        out = []
+        while self.buffer:
+            tag = THINK_CLOSE if self.in_think else THINK_OPEN
+            kind = "thinking" if self.in_think else "answer"
+            idx = self.buffer.find(tag)
+            if idx != -1:
+                if idx:
+                    out.append((kind, self.buffer[:idx]))
+                self.buffer = self.buffer[idx + len(tag):]
+                self.in_think = not self.in_think
+                continue
+
+            # 保留可能是标签开头的尾部
+            keep = 0
+            for n in range(min(len(tag) - 1, len(self.buffer)), 0, -1):
+                if tag.startswith(self.buffer[-n:]):
+                    keep = n
+                    break
+            text = self.buffer[:len(self.buffer) - keep]
+            if text:
+                out.append((kind, text))
+            self.buffer = self.buffer[len(self.buffer) - keep:]
+            break
+        return out
+
+    def flush(self) -> list[tuple[str, str]]:
+        """流结束时输出缓存中剩余的文本"""
+        out = [("thinking" if self.in_think else "answer", self.buffer)] if self.buffer else []
+        self.buffer = ""
+        return out
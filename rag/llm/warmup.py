@@ -0,0 +1,65 @@
+import asyncio
+import time
+
+
+class ModelWarmer:
+    """
+    Ollama 模型预热与驻留管理：
+    - 启动时按 `warmup.roles` 依次预热（模型加载进内存后首个问题无需等待加载）
+    - 后台循环：某模型空闲超过 `idle_rewarm` 秒时重新预热，配合 keep_alive 避免被 Ollama 卸载
+    - status() 给就绪检查接口使用
+    """
+
+    def __init__(self, async_client, config: dict):
+        warmup = config.get("warmup", {})
+        self.client = async_client
+        self.roles = warmup.get("roles", ["chat", "embedding"])
+        self.idle_rewarm = warmup.get("idle_rewarm", 25 * 60)
+        self.check_interval = warmup.get("check_interval", 60)
+        self.models = {role: async_client.models[role] for role in self.roles}
+        self.state = {role: {"model": model, "status": "pending", "warmed_at": None, "load_seconds": None,
+                             "error": None} for role, model in self.models.items()}
+
+    async def warm(self, role: str):
+        state = self.state[role]
+        state["status"] = "loading" if state["warmed_at"] is None else "rewarming"
+        start = time.perf_counter()
+        try:
+            await self.client.warm_up(role)
+        except Exception as e:
+            state.update(status="error", error=str(e))
+            print(f"⚠️ 模型预热失败 {state['model']}: {e}")
+            return
+        state.update(status="ready", warmed_at=time.time(), load_seconds=round(time.perf_counter() - start, 2),
+                     error=None)
+        print(f"🔥 模型已预热: {state['model']}（{state['load_seconds']}s）")
+
+    def _idle_seconds(self, role: str) -> float:
+        last = max(self.client.scheduler.last_active.get(self.models[role], 0), self.state[role]["warmed_at"] or 0)
+        return time.time() - last
+
+    async def run(self):
+        """启动预热 + 空闲重新预热，作为后台任务运行"""
+        for role in self.roles:  # 依次加载，避免多个模型同时争抢内存
+            await self.warm(role)
+        while True:
+            await asyncio.sleep(self.check_interval)
+            for role in self.roles:
+                if self.state[role]["status"] == "error" or self._idle_seconds(role) >= self.idle_rewarm:
+                    await self.warm(role)
+
+    async def status(self) -> dict:
+        """各模型预热状态 + Ollama 实际加载情况（/api/ps）"""
+        try:
+            loaded = await self.client.loaded_models()
+        except Exception as e:
+            loaded = None
+            print(f"⚠️ 查询 Ollama 已加载模型失败: {e}")
+        models = {}
+        for role, state in self.state.items():
+            models[role] = dict(state)
+            if loaded is not None:
+                models[role]["loaded"] = state["model"] in loaded
+                models[role]["expires_at"] = loaded.get(state["model"])
+        ready = all(s["status"] in ("ready", "rewarming") for s in self.state.values())
+        return {"ready": ready, "models": models}
@@ -1,134 +1,192 @@
-import argparse
-import ast
+import hashlib
 import os
 import re
-import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from difflib import SequenceMatcher
-from data.vision.t_ocr import run_ocr
 import cv2
 import fitz
+from rag.page_cache import page_cache, RENDER_DPI, HIGHLIGHT_DIR
+from rag.page_layout import page_layouts, to_page_boxes
 
-import os
 
-def clear_output_folder(output_dir: str):
-    """
-    清空 OCR 结果文件夹，防止重复命名
-    - `output_dir`: 需要清理的文件夹路径
-    """
-    if os.path.exists(output_dir):
-        shutil.rmtree(output_dir)  # **删除整个文件夹**
-        os.makedirs(output_dir)  # **重新创建空文件夹**
-        print(f"🗑️ 已清空文件夹: {output_dir}")
-    else:
-        os.makedirs(output_dir)  # **如果文件夹不存在，则创建**
-        print(f"📂 已创建文件夹: {output_dir}")
-##=============OCR=================
-def process_pdf_with_ocr(file_path):
-    """对扫描版 PDF 进行 OCR 处理"""
-    print(f"🖼️  处理扫描版 PDF: {file_path}")
+##=============Matching==============================
+COORD_RE = re.compile(r"@@\d+\s[\d.]+\s[\d.]+\s[\d.]+\s[\d.]+##")
+QUOTE_RE = re.compile(r"【(.+?)】")
+NGRAM = 2
 
-    try:
-        # 手动构造 `args`
-        args = argparse.Namespace(
-            inputs=file_path,  # 输入文件路径
-            output_dir="./ocr_results"  # 固定输出目录
-        )
 
-        # 运行 OCR 识别
-        ocr_results = run_ocr(args)
-        extracted_text = "\n".join(ocr_results) if ocr_results else ""
+def _ngrams(text: str, n: int = NGRAM) -> set[str]:
+    """字符 n-gram 集合（忽略空白）"""
+    text = re.sub(r"\s+", "", text)
+    if len(text) < n:
+        return {text} if text else set()
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
 
-        return extracted_text
 
-    except Exception as e:
-        print(f"❌ OCR 解析失败: {e}")
-        return ""
+def _citation_spans(line: str) -> list[tuple[int, str]]:
+    """一行中的引用 [(引用结束位置, 引用文本)]：有【】原文时只取原文，否则取整行；过短的忽略"""
+    spans = [(m.end(), m.group(1)) for m in QUOTE_RE.finditer(line)] or [(len(line), line)]
+    return [(end, text.strip()) for end, text in spans if len(text.strip()) >= 4]
 
-def run_pdf_ocr_for_highlight(pdf_path: str, output_dir: str) -> str:
-    """
-    运行 OCR 解析指定 PDF 并存储 OCR 识别的图像
-    - `pdf_path`: 需要 OCR 解析的 PDF 文件
-    - `output_dir`: OCR 生成的图片存放目录
-    """
-    extracted_text = process_pdf_with_ocr(pdf_path)  # OCR 处理 PDF
-    return extracted_text
 
+def citation_texts(referenced_texts: list[str]) -> list[str]:
+    """回答中的全部引用，下标即引用序号"""
+    return [text for line in referenced_texts for _, text in _citation_spans(line)]
 
-##=============Matching==============================
-import ast
 
-import re
+def annotate_citations(answer: str, highlights: list[dict]) -> str:
+    """在每条引用后插入 [🖼️N]，N 为包含该引用的高亮图片序号（从 1 开始，对应 highlight_citations 的返回顺序）"""
+    image_of = {}
+    for n, item in enumerate(highlights, 1):
+        for i in item["引用序号"]:
+            image_of.setdefault(i, n)
 
+    index = 0
+    lines = []
+    for line in answer.split("\n"):
+        out, last = "", 0
+        for end, _ in _citation_spans(line):
+            out += line[last:end] + (f"[🖼️{image_of[index]}]" if index in image_of else "")
+            last = end
+            index += 1
+        lines.append(out + line[last:])
+    return "\n".join(lines)
 
-def find_best_matching_passage(referenced_texts: list[str], ocr_results: list[dict]) -> dict:
+
+class PassageIndex:
     """
-    在 OCR 识别的文本中，找到与 LLM 生成的最终回答最相似的片段
+    检索文段的字符 n-gram 倒排索引：
+    - 引用先按 n-gram 覆盖率取 `top_k` 个候选，只对候选做 SequenceMatcher 精确对齐
+    - 坐标在建索引时一次性解析，按 `文本@@坐标##` 切成小段，匹配后只保留与引用重合的小段坐标
     """
-    best_match = None
-    best_score = 0
 
-    for ref_text in referenced_texts:
-        for passage in ocr_results:
+    def __init__(self, passages: list[dict], n: int = NGRAM):
+        self.n = n
+        self.candidates = []
+        self.postings = {}
+        seen = set()
+        for passage in passages:
             for ocr_text, _ in passage["相关内容"]:
-                match_score = SequenceMatcher(None, ref_text, ocr_text).ratio()
-
-                if match_score > best_score:
-                    coordinates = re.findall(r"@@\d+\s[\d.]+\s[\d.]+\s[\d.]+\s[\d.]+##", ocr_text)
+                if (passage["文件"], ocr_text) in seen:
+                    continue
+                seen.add((passage["文件"], ocr_text))
+
+                segments, last = [], 0
+                for m in COORD_RE.finditer(ocr_text):
+                    segments.append((m.group(0), _ngrams(ocr_text[last:m.start()], n)))
+                    last = m.end()
+                plain = COORD_RE.sub("", ocr_text)
+
+                cid = len(self.candidates)
+                self.candidates.append({"文件": passage["文件"], "text": ocr_text, "plain": plain,
+                                        "segments": segments})
+                for gram in _ngrams(plain, n):
+                    self.postings.setdefault(gram, []).append(cid)
+
+    def match(self, ref_text: str, top_k: int = 3):
+        """返回 (候选, 对齐分数, 引用 n-gram)，无候选时返回 None"""
+        grams = _ngrams(ref_text, self.n)
+        counts = {}
+        for gram in grams:
+            for cid in self.postings.get(gram, ()):
+                counts[cid] = counts.get(cid, 0) + 1
+        if not counts:
+            return None
+
+        best = None
+        for cid in sorted(counts, key=counts.get, reverse=True)[:top_k]:
+            candidate = self.candidates[cid]
+            matcher = SequenceMatcher(None, ref_text, candidate["plain"], autojunk=False)
+            score = sum(block.size for block in matcher.get_matching_blocks()) / len(ref_text)
+            if best is None or score > best[1]:
+                best = (candidate, score)
+        return best[0], best[1], grams
+
+    @staticmethod
+    def cited_coordinates(candidate: dict, grams: set[str], min_overlap: float = 0.5) -> list[str]:
+        """与引用重合度 >= min_overlap 的小段坐标；都不满足时返回整段坐标"""
+        coords = [coord for coord, seg_grams in candidate["segments"]
+                  if seg_grams and len(seg_grams & grams) / len(seg_grams) >= min_overlap]
+        return coords or [coord for coord, _ in candidate["segments"]]
+
+
+def find_matching_passages(referenced_texts: list[str], ocr_results: list[dict], threshold: float = 0.5,
+                           top_k: int = 3) -> list[dict]:
+    """
+    找到 LLM 回答中每条引用对应的文段，返回所有对齐分数 >= threshold 的匹配（同一文段的多条引用合并）
+    - 分数为引用中按顺序对齐到文段的字符比例
+    """
+    index = PassageIndex(ocr_results)
+    matches = {}
+    for i, ref_text in enumerate(citation_texts(referenced_texts)):
+        result = index.match(ref_text, top_k)
+        if result is None or result[1] < threshold:
+            continue
+        candidate, score, grams = result
+        key = (candidate["文件"], candidate["text"])
+        coords = index.cited_coordinates(candidate, grams)
+        if key not in matches:
+            matches[key] = {
+                "文件": candidate["文件"],
+                "引用内容": ref_text,
+                "匹配 OCR 文本": candidate["text"],
+                "匹配分数": score,
+                "坐标": coords,
+                "引用坐标": {i: coords}  # 引用序号 -> 该引用对应的坐标
+            }
+        else:
+            match = matches[key]
+            match["引用内容"] += "\n" + ref_text
+            match["匹配分数"] = max(match["匹配分数"], score)
+            match["坐标"] += [c for c in coords if c not in match["坐标"]]
+            match["引用坐标"][i] = coords
+    return sorted(matches.values(), key=lambda m: m["匹配分数"], reverse=True)
 
-                    best_match = {
-                        "文件": passage["文件"],
-                        "引用内容": ref_text,
-                        "匹配 OCR 文本": ocr_text,
-                        "匹配分数": match_score,
-                        "坐标": list(coordinates)  # **确保返回的是列表**
-                    }
-                    best_score = match_score
 
-    return best_match if best_match else {"匹配结果": "未找到匹配的 OCR 文段"}
+def find_best_matching_passage(referenced_texts: list[str], ocr_results: list[dict]) -> dict:
+    """
+    在 OCR 识别的文本中，找到与 LLM 生成的最终回答最相似的片段
+    """
+    matches = find_matching_passages(referenced_texts, ocr_results, threshold=0.0)
+    return matches[0] if matches else {"匹配结果": "未找到匹配的 OCR 文段"}
 
 
 ##=======================Highlight==============================
 
-def highlight_text_in_image(image_path: str, page_number: int, coordinates: list[dict], output_dir: str, pdf_width: int, pdf_height: int):
-    """
-    在 OCR 生成的图片上高亮 LLM 回答中引用的政策内容
-    - `image_path`: OCR 解析生成的图片路径
-    - `coordinates`: 需要高亮的坐标信息 (包含 page 和 bbox)
-    - `output_dir`: 输出带高亮的图片目录
-    - `pdf_width`: PDF 宽度 (默认 595.3)
-    - `pdf_height`: PDF 高度 (默认 841.9)
-    """
-
-    # **读取 OCR 解析的图片**
-    image = cv2.imread(image_path)
-    if image is None:
-        print(f"⚠️ 无法读取图片: {image_path}")
-        return
+HIGHLIGHT_DPI = RENDER_DPI
+# 高亮输出模式：
+# - "image": 服务端渲染整页 JPEG 并叠加高亮
+# - "pdf": 截取单页 PDF 并写入高亮注释（矢量；字体子集化后每页约 40~160KB，已是子集的字体无法再缩小）
+# 由 rag/llm/config.py 的 HIGHLIGHT_CONFIG 选择
+HIGHLIGHT_MODES = ("image", "pdf")
+HIGHLIGHT_MODE = "image"
 
-    # **获取图像实际尺寸**
-    img_height, img_width = image.shape[:2]
 
-    # **计算缩放比例**
-    scale_x = img_width / pdf_width
-    scale_y = img_height / pdf_height
+def parse_coordinate(coord: str) -> tuple[int, float, float, float, float]:
+    """`@@页码 x0 top x1 bottom##` -> (页码, x0, top, x1, bottom)，top/bottom 为跨页累计高度"""
+    values = coord.replace("@@", "").replace("##", "").split()
+    return int(values[0]), float(values[1]), float(values[2]), float(values[3]), float(values[4])
 
-    # **复制图片用于绘制**
-    overlay = image.copy()
 
-    # **遍历所有坐标，绘制高亮**
-    for coord in coordinates:
-        coords = list(map(float, coord.replace("@@", "").replace("##", "").split()))
+def page_boxes(pdf_path: str, coordinates: list[str]):
+    """坐标标签 -> 页内框 (N, 4) [x0, y0, x1, y1]（pt，左上角为原点），按该文档解析时记录的各页高度换算"""
+    return to_page_boxes(coordinates, page_layouts.get(pdf_path))[1].round(1)
 
 
-        # **修正 y 坐标（减去前面页的高度）**
-        corrected_y0 = coords[2] - (page_number - 1) * pdf_height
-        corrected_y1 = coords[4] - (page_number - 1) * pdf_height
+def highlight_text_in_image(image, boxes, scale: float, output_path: str):
+    """
+    在渲染出的页面图像上高亮 LLM 回答中引用的政策内容
+    - `image`: 页面图像（来自 page_cache，调用后会被修改）
+    - `boxes`: 需要高亮的页内框（page_boxes 的结果）
+    - `scale`: 图像像素 / PDF pt（dpi / 72）
+    - `output_path`: 输出带高亮的图片路径
+    """
+    # **复制图片用于绘制**
+    overlay = image.copy()
 
-        # **转换 PDF 坐标到图像坐标**
-        x0 = int(coords[1] * scale_x)
-        y0 = int(corrected_y0 * scale_y)
-        x1 = int(coords[3] * scale_x)
-        y1 = int(corrected_y1 * scale_y)
+    # **转换 PDF 坐标到图像坐标，绘制高亮**
+    for x0, y0, x1, y1 in (boxes * scale).astype(int).tolist():
 
         print(f"🔍  调整后坐标: x0={x0}, y0={y0}, x1={x1}, y1={y1}")
 
@@ -139,103 +197,119 @@ def highlight_text_in_image(image_path: str, page_number: int, coordinates: list
     alpha = 0.5
     cv2.addWeighted(overlay, alpha, image, 1 - alpha, 0, image)
 
-    # **保存高亮后的图片**
-    output_path = os.path.join(output_dir, os.path.basename(image_path).replace(".jpg", "_highlighted.jpg"))
-    cv2.imwrite(output_path, image)
-
-    print(f"✅ 高亮完成！已保存: {output_path}")
+    # **保存高亮后的图片（先写临时文件再替换，并发请求不会读到半张图）**
+    tmp_path = f"{output_path}.{threading.get_ident()}.tmp.jpg"
+    cv2.imwrite(tmp_path, image)
+    os.replace(tmp_path, output_path)
 
 
-##================================================
-def process_pdf_highlight(pdf_path: str, referenced_texts: list[str], extracted_text:list[dict], output_dir: str):
+def highlight_pdf_page(doc, page_number: int, boxes, output_path: str):
     """
-    1. 解析 PDF 进行 OCR
-    2. 找到 LLM 引用的政策内容
-    3. 在 OCR 生成的图片上高亮
+    截取单页 PDF，并把引用内容写成高亮注释（浏览器 PDF 阅读器可直接显示）
+    - insert_pdf 会带上该页引用的完整字体，中文字体动辄上百 KB，这里只保留该页用到的字形
     """
-    print(f"\n🔍 **正在处理 OCR 解析 PDF:** {pdf_path}")
-    clear_output_folder(output_dir)
+    with fitz.open() as single:
+        single.insert_pdf(doc, from_page=page_number - 1, to_page=page_number - 1)
+        page = single[0]
+        for box in boxes.tolist():
+            page.add_highlight_annot(fitz.Rect(*box))
 
-    # **匹配 LLM 回答**
-    matched_passages = find_best_matching_passage(referenced_texts, extracted_text)
-    image_paths = []
+        try:
+            single.subset_fonts()  # 依赖 fontTools，未安装时保留完整字体
+        except Exception as e:
+            print(f"⚠️ 字体子集化失败，保留完整字体: {e}")
+        tmp_path = f"{output_path}.{threading.get_ident()}.tmp.pdf"
+        single.save(tmp_path, garbage=4, deflate=True, deflate_fonts=True, deflate_images=True, clean=True)
+    os.replace(tmp_path, output_path)
 
-    if matched_passages:
-        # **2. 确保 "坐标" 是列表**
-        if isinstance(matched_passages["坐标"], str):
-            matched_passages["坐标"] = ast.literal_eval(matched_passages["坐标"])  # 转换为列表
 
-        # **3. 确定 PDF 文件路径**
-        pdf_filename = matched_passages["文件"]
-        pdf_path = os.path.join(pdf_path, pdf_filename)  # 改写路径
+def highlight_filename(pdf_path: str, page_number: int, boxes, dpi: int, ext: str = "jpg") -> str:
+    """按 (文件内容, 页码, 页内框, DPI) 生成内容寻址的文件名，相同高亮跨请求复用"""
+    digest = hashlib.sha1("|".join([page_cache.file_hash(pdf_path), str(page_number), str(dpi)] +
+                                   sorted(map(str, boxes.tolist()))).encode("utf-8")).hexdigest()[:16]
+    return f"{page_number - 1}_highlighted_{digest}.{ext}"
 
-        doc = fitz.open(pdf_path)
 
-        # **获取第一页的尺寸**
-        pdf_rect = doc[0].rect
-        pdf_width, pdf_height = pdf_rect.width, pdf_rect.height
-
-        print(pdf_width, pdf_height )
-        # **4. 运行 OCR 解析**
-        run_pdf_ocr_for_highlight(pdf_path, output_dir)
-
-        # **5. 解析 PDF 页码**
-        page_number = int(re.search(r"@@(\d+)", matched_passages["坐标"][0]).group(1))  # 提取页码
+##================================================
+HIGHLIGHT_WORKERS = 4
+_highlight_executor = ThreadPoolExecutor(max_workers=HIGHLIGHT_WORKERS, thread_name_prefix="highlight")
 
-        # **6. 计算 OCR 生成的图片路径**
-        image_path = os.path.join(output_dir, f"{page_number - 1}.jpg")  # 正确拼接文件名
 
-        print(matched_passages["坐标"])
+def _highlight_page(file_path: str, page_number: int, coordinates: list[str], output_dir: str, dpi: int,
+                    mode: str) -> dict:
+    """
+    单页高亮：所有框在一次叠加中绘制；相同高亮已存在时直接复用（每个任务独立打开文档，fitz 文档不可跨线程共享）
+    返回 {"图片": 输出文件路径}
+    """
+    boxes = page_boxes(file_path, coordinates)
+    ext = "pdf" if mode == "pdf" else "jpg"
+    output_path = os.path.join(output_dir, highlight_filename(file_path, page_number, boxes, dpi, ext))
+    try:
+        os.utime(output_path)
+        print(f"♻️ 复用已有高亮: {output_path}")
+        return {"图片": output_path}
+    except FileNotFoundError:  # 未生成过，或刚被配额清理删除：重新生成
+        pass
+
+    with fitz.open(file_path) as doc:
+        if mode == "pdf":
+            highlight_pdf_page(doc, page_number, boxes, output_path)
+        else:
+            image = page_cache.get(file_path, page_number, dpi, doc)
+            highlight_text_in_image(image, boxes, dpi / 72, output_path)
+    print(f"✅ 高亮完成！已保存: {output_path}")
+    return {"图片": output_path}
 
-        # **7. 在 OCR 图片上高亮**
-        highlight_text_in_image(image_path, page_number, matched_passages["坐标"], output_dir, pdf_width, pdf_height)
 
-        highlighted_image_path = image_path.replace('.jpg', '_highlighted.jpg')
-        image_paths.append(highlighted_image_path)  # 将图像路径添加到列表
+def highlight_citations(pdf_path: str, referenced_texts: list[str], extracted_text: list[dict],
+                        output_dir: str = HIGHLIGHT_DIR, dpi: int = HIGHLIGHT_DPI,
+                        mode: str = HIGHLIGHT_MODE) -> list[dict]:
+    """
+    批量高亮 LLM 回答中的所有引用：
+    1. 找到每条引用对应的文段与坐标（find_matching_passages）
+    2. 按 (文件, 页码) 分组，每个不同的页只处理一次，该页所有框一次绘制
+    3. 不同页在线程池中并行处理
+    返回 [{"文件", "页码", "图片", "引用序号"}]，按首次被引用的顺序排列；引用序号对应 citation_texts 的下标
+    - `mode`: 见 HIGHLIGHT_MODES；"pdf" 时 "图片" 为单页 PDF 路径
+    """
+    if mode not in HIGHLIGHT_MODES:
+        raise ValueError(f"未知的高亮模式: {mode}")
+    os.makedirs(output_dir, exist_ok=True)
 
-        print(f"✅ 高亮完成！已保存: {highlighted_image_path}")
-    else:
+    # **匹配 LLM 回答**
+    matched_passages = find_matching_passages(referenced_texts, extracted_text)
+    if not matched_passages:
         print("❌ 未找到匹配的 OCR 片段，无法高亮。")
-
-    return image_paths  # 返回图像路径列表
-
-
-
-
-
-
-
-
-# **测试代码**
-if __name__ == "__main__":
-    pdf_path = "C:/Users/ROG/PycharmProjects/final/data/policy"  # 你的 PDF 文件路径
-    output_dir = "C:/Users/ROG/PycharmProjects/final/rag/ocr_results"  # OCR 生成的图片目录
-    # 传入 LLM 生成的引用文本
-    referenced_texts = [
-        "2.学术论文需提交检索报告，",
-        "以第一作者在B级期刊上发表专业相关的学术",
-        "有争议的成果由学院推免工"
-    ]
-
-    # 传入 OCR 识别的政策文档片段
-    ocr_results = [
-        {'文件': '西南大学计算机与信息科学学院 软件学院推荐优秀本科毕业生免试攻读硕士学位研究生工作实施细则（202.pdf',
-         '相关内容': [
-             ('@@5\t431.3\t3781.0\t446.7\t3792.7##\n2.学术论文需提交检索报告，@@5\t429.0\t3796.0\t544.0\t3808.3##\n'
-              '以第一作者在B级期刊上发表专业相关的学术@@5\t81.7\t3811.0\t261.3\t3823.3##\n'
-              '有争议的成果由学院推免工@@5\t432.3\t3811.7\t538.7\t3824.0##\n'
-              '2.4@@5\t51.3\t3827.7\t69.0\t3838.0##', 5.041)]
-         },
-        {'文件': '附件1：西南大学本科毕业论文（设计）规范.docx',
-         '相关内容': [
-             (
-             '对于一些不宜放入正文中，但对毕业论文（设计）有参考价值的内容，或以他人阅读方便的工具性资料，如调查问卷、公式推演、编写程序、原始数据附表等，可编入附录中格式同正文',
-             3.265)]
-         }
-    ]
-
-    process_pdf_highlight(pdf_path, referenced_texts, ocr_results, output_dir)
-
-
-
-    print("✅ OCR 解析完成！")
+        return []
+
+    # **按 (文件, 页码) 分组坐标与引用序号**
+    pages = {}
+    for match in matched_passages:
+        for i, coords in match["引用坐标"].items():
+            for coord in coords:
+                page = pages.setdefault((match["文件"], parse_coordinate(coord)[0]), {"坐标": [], "引用序号": set()})
+                if coord not in page["坐标"]:
+                    page["坐标"].append(coord)
+                page["引用序号"].add(i)
+    groups = sorted(pages.items(), key=lambda item: min(item[1]["引用序号"]))
+
+    futures = [_highlight_executor.submit(_highlight_page, os.path.join(pdf_path, pdf_filename), page_number,
+                                          page["坐标"], output_dir, dpi, mode)
+               for (pdf_filename, page_number), page in groups]
+
+    results = []
+    for ((pdf_filename, page_number), page), future in zip(groups, futures):
+        try:
+            output = future.result()
+        except Exception as e:
+            print(f"⚠️ 高亮失败: {pdf_filename} 第 {page_number} 页, {e}")
+            continue
+        results.append({"文件": pdf_filename, "页码": page_number, **output, "引用序号": sorted(page["引用序号"])})
+    return results
+
+
+def process_pdf_highlight(pdf_path: str, referenced_texts: list[str], extracted_text: list[dict],
+                          output_dir: str = HIGHLIGHT_DIR, dpi: int = HIGHLIGHT_DPI, mode: str = HIGHLIGHT_MODE):
+    """highlight_citations 的简化接口，只返回图像路径列表"""
+    return [item["图片"] for item in highlight_citations(pdf_path, referenced_texts, extracted_text, output_dir, dpi,
+                                                         mode)]
@@ -1,13 +1,18 @@
 # -*- coding: utf-8 -*-
 
+import atexit
 import copy
 import datrie
 import math
+import multiprocessing
 import os
 import re
 import string
 import sys
-from hanziconv import HanziConv
+import threading
+import weakref
+from functools import lru_cache
+from hanziconv.charmap import simplified_charmap, traditional_charmap
 from huggingface_hub import snapshot_download
 from nltk import word_tokenize
 from nltk.stem import PorterStemmer, WordNetLemmatizer
@@ -34,11 +39,73 @@ def get_project_base_directory(*args):
     return PROJECT_BASE
 
 
+# 全角转半角：U+3000 -> 空格，U+FF00~U+FF5E -> U+0020~U+007E
+_Q2B = {0x3000: 0x0020}
+_Q2B.update({c: c - 0xfee0 for c in range(0xff00, 0xff5f)})
+# 全角转半角 + ASCII 小写，一次 str.translate 完成
+_Q2B_LOWER = {k: ord(chr(v).lower()) for k, v in _Q2B.items()}
+_Q2B_LOWER.update({c: c + 32 for c in range(ord("A"), ord("Z") + 1)})
+
+# 繁转简：与 HanziConv.toSimplified 一致（取字表中首次出现的映射）
+_TRADI2SIMP = {}
+for _t, _s in zip(traditional_charmap, simplified_charmap):
+    if _t != _s:
+        _TRADI2SIMP.setdefault(ord(_t), _s)
+_TRADI_RE = re.compile("[%s]" % re.escape("".join(map(chr, _TRADI2SIMP))))
+del _t, _s
+
+_ZH_RE = re.compile(r"[\u4e00-\u9fa5]")
+_NEWLINE_RE = re.compile(r"[\r\n]+")
+_DICT_SEP_RE = re.compile(r"[ \t]")
+_SPACES_RE = re.compile(r"[ ]+")
+_ALPHA_RE = re.compile(r"[a-z\.-]+$")
+_NUM_RE = re.compile(r"[0-9\.-]+$")
+_NUM_PUNCT_RE = re.compile(r"[0-9,\.-]+$")
+_ENGLISH_RE = re.compile(r"[a-zA-Z_-]+$")
+_ENDS_ALPHA_RE = re.compile(r".*[a-zA-Z]$")
+
+
+# tokenize_many 启用多进程的最小总字符数
+PARALLEL_MIN_CHARS = 2_000_000
+# 运行时新增词条的持久化文件（与 huqie.txt 同格式：词 词频 词性），基础词典与 .trie 保持不动
+USER_DICT_FILE = get_project_base_directory("rag/res", "huqie_user.txt")
+# 新增词条攒批写盘的等待时间（秒）
+USER_DICT_FLUSH_DELAY = 2.0
+
+
+@lru_cache(maxsize=1 << 16)
+def _key(line):
+    return str(line.lower().encode("utf-8"))[2:-1]
+
+
+class _OverlayTrie:
+    """在基础 trie 之上叠加内存 overlay 词典，查询时 overlay 优先"""
+
+    def __init__(self, base, overlay):
+        self.base = base
+        self.overlay = overlay
+
+    def __contains__(self, k):
+        return k in self.overlay or k in self.base
+
+    def __getitem__(self, k):
+        if k in self.overlay:
+            return self.overlay[k]
+        return self.base[k]
+
+    def __setitem__(self, k, v):
+        self.base[k] = v
+
+    def has_keys_with_prefix(self, k):
+        return self.overlay.has_keys_with_prefix(k) or self.base.has_keys_with_prefix(k)
+
+    def save(self, fnm):
+        self.base.save(fnm)
 
 
 class RagTokenizer:
     def key_(self, line):
-        return str(line.lower().encode("utf-8"))[2:-1]
+        return _key(line)
 
     def rkey_(self, line):
         return str(("DD" + (line[::-1].lower())).encode("utf-8"))[2:-1]
@@ -51,14 +118,15 @@ class RagTokenizer:
                 line = of.readline()
                 if not line:
                     break
-                line = re.sub(r"[\r\n]+", "", line)
-                line = re.split(r"[ \t]", line)
+                line = _NEWLINE_RE.sub("", line)
+                line = _DICT_SEP_RE.split(line)
                 k = self.key_(line[0])
                 F = int(math.log(float(line[1]) / self.DENOMINATOR) + .5)
                 if k not in self.trie_ or self.trie_[k][0] < F:
                     self.trie_[self.key_(line[0])] = (F, line[2])
                 self.trie_[self.rkey_(line[0])] = 1
             self.trie_.save(fnm + ".trie")
+            self.trie_path_ = fnm + ".trie"
             of.close()
         except Exception as e:
             print("[HUQIE]:Faild to build trie, ", fnm, e, file=sys.stderr)
@@ -68,48 +136,136 @@ class RagTokenizer:
         self.DENOMINATOR = 1000000
         self.trie_ = datrie.Trie(string.printable)
         self.DIR_ = os.path.join(get_project_base_directory(), "rag/res", "huqie")
+        self.overlay_ = datrie.Trie(string.printable)
+        self.overlay_lock_ = threading.Lock()
+        self.merge_lock_ = threading.Lock()
+        self.user_dict_path_ = USER_DICT_FILE
+        self.pending_terms_ = []  # 待写入用户词典的 (词, 词频, 词性)
+        self.flush_timer_ = None
+        self.vocab_version_ = 0  # 词表每变化一次 +1
+        self.vocab_listeners_ = []  # 词表变化回调（弱引用，不延长监听者生命周期）
 
         self.stemmer = PorterStemmer()
         self.lemmatizer = WordNetLemmatizer()
 
         self.SPLIT_CHAR = r"([ ,\.<>/?;'\[\]\\`!@#$%^&*\(\)\{\}\|_+=《》，。？、；‘’：“”【】~！￥%……（）——-]+|[a-z\.-]+|[0-9,\.-]+)"
+        self.SPLIT_RE = re.compile(self.SPLIT_CHAR)
+        self.trie_path_ = self.DIR_ + ".txt.trie"
         try:
-            self.trie_ = datrie.Trie.load(self.DIR_ + ".txt.trie")
-            return
+            self.trie_ = datrie.Trie.load(self.trie_path_)
         except Exception as e:
             print("[HUQIE]:Build default trie", file=sys.stderr)
             self.trie_ = datrie.Trie(string.printable)
+            self.loadDict_(self.DIR_ + ".txt")
+        self._load_user_terms_()
 
-        self.loadDict_(self.DIR_ + ".txt")
+    def _load_user_terms_(self):
+        """启动时把用户词典载入 overlay（后写入的同名词条覆盖先前的）"""
+        if not os.path.exists(self.user_dict_path_):
+            return
+        count = 0
+        with open(self.user_dict_path_, "r", encoding="utf-8") as f:
+            for line in f:
+                parts = _DICT_SEP_RE.split(_NEWLINE_RE.sub("", line))
+                if len(parts) < 3:
+                    continue
+                try:
+                    self._set_overlay_(parts[0], float(parts[1]), parts[2])
+                    count += 1
+                except ValueError:
+                    print("[HUQIE]:Skip bad user term, ", line.strip(), file=sys.stderr)
+        self._apply_overlay_(self._base_trie_())
+        print("[HUQIE]:Loaded %d user terms from" % count, self.user_dict_path_, file=sys.stderr)
 
     def loadUserDict(self, fnm):
         try:
-            self.trie_ = datrie.Trie.load(fnm + ".trie")
+            self._apply_overlay_(datrie.Trie.load(fnm + ".trie"))
+            self.trie_path_ = fnm + ".trie"
             return
         except Exception as e:
-            self.trie_ = datrie.Trie(string.printable)
+            self._apply_overlay_(datrie.Trie(string.printable))
         self.loadDict_(fnm)
 
     def addUserDict(self, fnm):
         self.loadDict_(fnm)
 
+    def _apply_overlay_(self, base):
+        """overlay 非空时用 _OverlayTrie 包装基础 trie，否则直接使用基础 trie"""
+        self.trie_ = _OverlayTrie(base, self.overlay_) if len(self.overlay_) else base
+
+    def _base_trie_(self):
+        return self.trie_.base if isinstance(self.trie_, _OverlayTrie) else self.trie_
+
+    def on_vocab_change(self, callback):
+        """注册词表变化回调 callback(version)，新增词条后调用（依赖分词结果做缓存的模块用它清缓存）"""
+        ref = weakref.WeakMethod(callback) if hasattr(callback, "__self__") else (lambda: callback)
+        with self.overlay_lock_:
+            self.vocab_listeners_.append(ref)
+
+    def _notify_vocab_change_(self):
+        with self.overlay_lock_:
+            self.vocab_version_ += 1
+            version = self.vocab_version_
+            self.vocab_listeners_ = [ref for ref in self.vocab_listeners_ if ref() is not None]
+            callbacks = [ref() for ref in self.vocab_listeners_]
+        for callback in callbacks:
+            if callback is not None:
+                callback(version)
+
+    def _set_overlay_(self, word, freq, tag):
+        if freq <= 0 or not word or not tag or _DICT_SEP_RE.search(word + tag) or _NEWLINE_RE.search(word + tag):
+            raise ValueError("invalid user term: %r %r" % (word, freq))
+        F = int(math.log(float(freq) / self.DENOMINATOR) + .5)
+        self.overlay_[self.key_(word)] = (F, tag)
+        self.overlay_[self.rkey_(word)] = 1
+
+    def add_term(self, word, freq, tag="n", persist=True):
+        """
+        运行时新增词条，立即生效，无需重建主词典
+        - 词条写入内存 overlay，分词时优先于基础 trie（基础 trie 与 huqie.txt 不做修改）
+        - `persist=True` 时攒批追加到用户词典文件 USER_DICT_FILE，启动时重新载入
+        """
+        with self.overlay_lock_:
+            self._set_overlay_(word, freq, tag)
+            self._apply_overlay_(self._base_trie_())
+            if persist:
+                self.pending_terms_.append((word, freq, tag))
+                if self.flush_timer_ is None:
+                    self.flush_timer_ = threading.Timer(USER_DICT_FLUSH_DELAY, self.merge_overlay)
+                    self.flush_timer_.daemon = True
+                    self.flush_timer_.start()
+        self._notify_vocab_change_()
+
+    def merge_overlay(self):
+        """把攒下的新增词条一次性追加写入用户词典文件"""
+        with self.merge_lock_:
+            with self.overlay_lock_:
+                terms, self.pending_terms_ = self.pending_terms_, []
+                if self.flush_timer_ is not None:
+                    self.flush_timer_.cancel()
+                    self.flush_timer_ = None
+            if not terms:
+                return
+            os.makedirs(os.path.dirname(self.user_dict_path_), exist_ok=True)
+            with open(self.user_dict_path_, "a", encoding="utf-8") as f:
+                f.writelines("%s %d %s\n" % (word, freq, tag) for word, freq, tag in terms)
+            print("[HUQIE]:Saved %d user terms to" % len(terms), self.user_dict_path_, file=sys.stderr)
+
     def _strQ2B(self, ustring):
         """把字符串全角转半角"""
-        rstring = ""
-        for uchar in ustring:
-            inside_code = ord(uchar)
-            if inside_code == 0x3000:
-                inside_code = 0x0020
-            else:
-                inside_code -= 0xfee0
-            if inside_code < 0x0020 or inside_code > 0x7e:  # 转完之后不是半角字符返回原来的字符
-                rstring += uchar
-            else:
-                rstring += chr(inside_code)
-        return rstring
+        return ustring.translate(_Q2B)
 
     def _tradi2simp(self, line):
-        return HanziConv.toSimplified(line)
+        if not _TRADI_RE.search(line):
+            return line
+        return line.translate(_TRADI2SIMP)
+
+    def _normalize(self, line):
+        """全角转半角 + 小写 + 繁转简"""
+        line = line.translate(_Q2B_LOWER)
+        if not line.isascii():
+            line = self._tradi2simp(line.lower())
+        return line
 
     def dfs_(self, chars, s, preTks, tkslist):
         MAX_L = 10
@@ -193,23 +349,19 @@ class RagTokenizer:
         return sorted(res, key=lambda x: x[1], reverse=True)
 
     def merge_(self, tks):
-        patts = [
-            (r"[ ]+", " "),
-            (r"([0-9\+\.,%\*=-]) ([0-9\+\.,%\*=-])", r"\1\2"),
-        ]
-        # for p,s in patts: tks = re.sub(p, s, tks)
-
         # if split chars is part of token
+        # 任一 token 含切分字符 <=> 拼接后的窗口含切分字符，故每个 token 只需匹配一次
         res = []
-        tks = re.sub(r"[ ]+", " ", tks).split(" ")
+        tks = _SPACES_RE.sub(" ", tks).split(" ")
+        has_split = [self.SPLIT_RE.search(tk) is not None for tk in tks]
         s = 0
-        while True:
-            if s >= len(tks):
-                break
+        while s < len(tks):
             E = s + 1
-            for e in range(s + 2, min(len(tks) + 2, s + 6)):
-                tk = "".join(tks[s:e])
-                if re.search(self.SPLIT_CHAR, tk) and self.freq(tk):
+            tk, hit = tks[s], has_split[s]
+            for e in range(s + 2, min(len(tks), s + 5) + 1):
+                tk += tks[e - 1]
+                hit = hit or has_split[e - 1]
+                if hit and self.freq(tk):
                     E = e
             res.append("".join(tks[s:E]))
             s = E
@@ -264,20 +416,17 @@ class RagTokenizer:
         return self.score_(res[::-1])
 
     def english_normalize_(self, tks):
-        return [self.stemmer.stem(self.lemmatizer.lemmatize(t)) if re.match(r"[a-zA-Z_-]+$", t) else t for t in tks]
+        return [self.stemmer.stem(self.lemmatizer.lemmatize(t)) if _ENGLISH_RE.match(t) else t for t in tks]
 
     def tokenize(self, line):
-        line = self._strQ2B(line).lower()
-        line = self._tradi2simp(line)
-        zh_num = len([1 for c in line if is_chinese(c)])
-        if zh_num == 0:
+        line = self._normalize(line)
+        if not _ZH_RE.search(line):
             return " ".join([self.stemmer.stem(self.lemmatizer.lemmatize(t)) for t in word_tokenize(line)])
 
-        arr = re.split(self.SPLIT_CHAR, line)
+        arr = self.SPLIT_RE.split(line)
         res = []
         for L in arr:
-            if len(L) < 2 or re.match(
-                    r"[a-z\.-]+$", L) or re.match(r"[0-9\.-]+$", L):
+            if len(L) < 2 or _ALPHA_RE.match(L) or _NUM_RE.match(L):
                 res.append(L)
                 continue
             # print(L)
@@ -334,7 +483,7 @@ class RagTokenizer:
 
         res = []
         for tk in tks:
-            if len(tk) < 3 or re.match(r"[0-9,\.-]+$", tk):
+            if len(tk) < 3 or _NUM_PUNCT_RE.match(tk):
                 res.append(tk)
                 continue
             tkslist = []
@@ -349,7 +498,7 @@ class RagTokenizer:
             if len(stk) == len(tk):
                 stk = tk
             else:
-                if re.match(r"[a-z\.-]+$", tk):
+                if _ALPHA_RE.match(tk):
                     for t in stk:
                         if len(t) < 3:
                             stk = tk
@@ -363,6 +512,49 @@ class RagTokenizer:
 
         return " ".join(self.english_normalize_(res))
 
+    def tokenize_many(self, lines, workers=None, chunksize=None, min_chars=PARALLEL_MIN_CHARS):
+        """
+        批量分词，按输入顺序返回结果
+        - `workers`: 进程数，默认 CPU 核数；<= 1 时退化为单进程
+        - 总字符数不足 `min_chars` 时直接单进程分词（进程启动与加载词典的开销比分词本身还大）
+        - 子进程以 spawn 方式启动（不 fork 带有线程的父进程），直接从磁盘加载已持久化的 `.trie` 文件，不经由 pickle 拷贝词典
+        """
+        lines = list(lines)
+        if workers is None:
+            workers = os.cpu_count() or 1
+        workers = min(workers, len(lines))
+        if workers <= 1 or multiprocessing.parent_process() is not None \
+                or sum(len(line) for line in lines) < min_chars:
+            return [self.tokenize(line) for line in lines]
+
+        if chunksize is None:
+            chunksize = max(1, len(lines) // (workers * 4))
+        ctx = multiprocessing.get_context("spawn")
+        with ctx.Pool(workers, initializer=_init_pool_worker,
+                      initargs=(self.trie_path_, self.overlay_.items())) as pool:
+            return pool.map(_pool_tokenize, lines, chunksize)
+
+
+_pool_tokenizer = None
+
+
+def _init_pool_worker(trie_path, overlay_items):
+    """进程池初始化：复用模块级分词器，按父进程当前词典加载 trie 与 overlay"""
+    global _pool_tokenizer
+    _pool_tokenizer = tokenizer
+    base = _pool_tokenizer._base_trie_()
+    if _pool_tokenizer.trie_path_ != trie_path:
+        base = datrie.Trie.load(trie_path)
+        _pool_tokenizer.trie_path_ = trie_path
+    _pool_tokenizer.overlay_ = datrie.Trie(string.printable)
+    for k, v in overlay_items:
+        _pool_tokenizer.overlay_[k] = v
+    _pool_tokenizer._apply_overlay_(base)
+
+
+def _pool_tokenize(line):
+    return _pool_tokenizer.tokenize(line)
+
 
 def is_chinese(s):
     if s >= u'\u4e00' and s <= u'\u9fa5':
@@ -389,8 +581,7 @@ def is_alphabet(s):
 def naiveQie(txt):
     tks = []
     for t in txt.split(" "):
-        if tks and re.match(r".*[a-zA-Z]$", tks[-1]
-                            ) and re.match(r".*[a-zA-Z]$", t):
+        if tks and _ENDS_ALPHA_RE.match(tks[-1]) and _ENDS_ALPHA_RE.match(t):
             tks.append(" ")
         tks.append(t)
     return tks
@@ -398,11 +589,15 @@ def naiveQie(txt):
 
 tokenizer = RagTokenizer()
 tokenize = tokenizer.tokenize
+tokenize_many = tokenizer.tokenize_many
 fine_grained_tokenize = tokenizer.fine_grained_tokenize
 tag = tokenizer.tag
 freq = tokenizer.freq
 loadUserDict = tokenizer.loadUserDict
 addUserDict = tokenizer.addUserDict
+add_term = tokenizer.add_term
+merge_overlay = tokenizer.merge_overlay
+atexit.register(tokenizer.merge_overlay)  # 退出前写入尚未落盘的新增词条
 tradi2simp = tokenizer._tradi2simp
 strQ2B = tokenizer._strQ2B
 
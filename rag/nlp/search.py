@@ -30,11 +30,13 @@ def keyword_match_score(query_tokens, text):
     return match_count / max(len(query_tokens), 1)  # 归一化，防止除 0 错误
 
 class SearchEngine:
-    def __init__(self, dim=300, score_threshold=0.5):
+    def __init__(self, dim=300, score_threshold=0.5, workers=None):
         """
         初始化搜索引擎，加载 JSON 格式的政策文档，并使用 FAISS + BM25 进行检索
+        - `workers`: 建索引时的分词进程数（默认 CPU 核数；语料较小时 tokenize_many 自动单进程分词，不会创建进程池）
         """
         self.dim = dim
+        self.workers = workers
         self.tw = term_weight.Dealer()
         self.score_threshold = score_threshold  # 设定最低分数阈值
 
@@ -42,7 +44,8 @@ class SearchEngine:
         self.documents = self.load_policy_documents()
 
         if self.documents:  # ✅ 仅在 documents 非空时初始化 BM25
-            tokenized_corpus = [rag_tokenizer.tokenize(self.get_clean_text(doc)).split() for doc in self.documents]
+            tokenized_corpus = [tks.split() for tks in rag_tokenizer.tokenize_many(
+                [self.get_clean_text(doc) for doc in self.documents], workers=workers)]
             self.bm25 = BM25Okapi(tokenized_corpus)
         else:
             self.bm25 = None  # ✅ BM25 未初始化
@@ -132,10 +135,10 @@ class SearchEngine:
     def build_faiss_index(self):
         """构建 FAISS 向量索引"""
         embeddings = []
-        for doc in self.documents:
-            all_text = " ".join(doc["text_chunks"])
-            tokens = rag_tokenizer.tokenize(all_text).split()
-            doc_vector = [weight for _, weight in self.tw.weights(tokens)]
+        all_tokens = rag_tokenizer.tokenize_many(
+            [" ".join(doc["text_chunks"]) for doc in self.documents], workers=self.workers)
+        for tw in self.tw.weights_batch([tks.split() for tks in all_tokens]):
+            doc_vector = [weight for _, weight in tw]
 
             if len(doc_vector) < self.dim:
                 doc_vector = np.pad(doc_vector, (0, self.dim - len(doc_vector)), mode='constant')
@@ -170,9 +173,8 @@ class SearchEngine:
 
         # **针对每个 text_chunk 计算 FAISS 分数**
         chunk_vectors = []
-        for chunk in all_chunks:
-            tokens = rag_tokenizer.tokenize(chunk["内容"]).split()
-            vector = [weight for _, weight in self.tw.weights(tokens)]
+        for tw in self.tw.weights_batch(bm25_corpus):
+            vector = [weight for _, weight in tw]
 
             # **确保向量长度一致**
             if len(vector) < self.dim:
@@ -186,18 +188,16 @@ class SearchEngine:
         if chunk_vectors:
             chunk_vectors = np.array(chunk_vectors, dtype=np.float32)
 
-            # ✅ **清空 FAISS 旧向量，避免 index 超出范围**
-            if self.faiss_index.ntotal > 0:
-                self.faiss_index.reset()
-
-            self.faiss_index.add(chunk_vectors)
+            # ✅ **每次检索使用独立的 FAISS 索引，避免并发检索互相覆盖**
+            faiss_index = faiss.IndexFlatL2(self.dim)
+            faiss_index.add(chunk_vectors)
 
             query_vector = np.array([weight for _, weight in self.tw.weights(query_tokens)]).astype('float32')
             query_vector = np.pad(query_vector, (0, self.dim - len(query_vector)), mode='constant') if len(
                 query_vector) < self.dim else query_vector[:self.dim]
             query_vector = query_vector.reshape(1, -1)
 
-            _, faiss_indices = self.faiss_index.search(query_vector, top_k)
+            _, faiss_indices = faiss_index.search(query_vector, top_k)
             faiss_scores = np.zeros(len(all_chunks))
 
             # ✅ **检查索引范围，避免 `IndexError`**
@@ -1,17 +1,20 @@
 # -*- coding: utf-8 -*-
-import math
 import json
 import re
 import os
 import numpy as np
+from functools import lru_cache
 from rag.nlp import rag_tokenizer
 
+PRETOKEN_PATT = re.compile(r"[~—\t @#%!<>,\.\?\":;'\{\}\[\]_=\(\)\|，。？》•●○↓《；‘’：“”【¥ 】…￥！、·（）×`&\\/「」\\]")
+DIGIT_PATT = re.compile(r"[0-9]$")
+
 
 class Dealer:
     def __init__(self):
         # 获取 `rag/` 目录的基础路径
         base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))  # `rag/nlp/` -> `rag/`
-        res_dir = os.path.join(base_dir, "res")  # 资源文件目录
+        res_dir = self.res_dir = os.path.join(base_dir, "res")  # 资源文件目录
 
         # 停用词列表（优化）
         self.stop_words = set([
@@ -26,6 +29,18 @@ class Dealer:
         # 加载 term 词频数据
         self.df = self.load_term_freq(os.path.join(res_dir, "term.freq"))
 
+        # 预计算词表权重数组（IDF × NER 系数）
+        self.build_weight_table()
+        self.term_ids = lru_cache(maxsize=1 << 16)(self.term_ids)
+        # 新增分词词条后，旧的分词结果与词表下标失效
+        rag_tokenizer.tokenizer.on_vocab_change(self.on_vocab_change)
+
+    def on_vocab_change(self, version=None):
+        """分词词表变化：重建权重表（词频 / NER 文件可能随之更新）并清空 token 缓存"""
+        self.df = self.load_term_freq(os.path.join(self.res_dir, "term.freq"))
+        self.build_weight_table()
+        self.term_ids.cache_clear()
+
     def load_json(self, path):
         """加载 JSON 文件"""
         try:
@@ -50,15 +65,22 @@ class Dealer:
             print(f"[WARNING] Load {path} FAIL: {e}")
         return term_freq
 
+    def build_weight_table(self, N=1000000):
+        """词表（term.freq + NER）-> 下标，权重数组最后一位留给词表外的词（默认词频 3）"""
+        vocab = list(dict.fromkeys(list(self.df) + list(self.ne)))
+        self.vocab = {t: i for i, t in enumerate(vocab)}
+        s = np.array([self.df.get(t, 3) for t in vocab] + [3], dtype=np.float64)
+        idf = np.log10(10 + ((N - s + 0.5) / (s + 0.5)))
+        ner = np.array([1.5 if self.ner(t) else 1 for t in vocab] + [1], dtype=np.float64)
+        self.term_weight = idf * ner
+
     def pretoken(self, txt, num=False, stpwd=True):
         """预处理文本（分词 + 去除无效字符）"""
-        patt = [r"[~—\t @#%!<>,\.\?\":;'\{\}\[\]_=\(\)\|，。？》•●○↓《；‘’：“”【¥ 】…￥！、·（）×`&\\/「」\\]"]
-        for p in patt:
-            txt = re.sub(p, " ", txt)
+        txt = PRETOKEN_PATT.sub(" ", txt)
 
         res = []
         for t in rag_tokenizer.tokenize(txt).split():
-            if (stpwd and t in self.stop_words) or (re.match(r"[0-9]$", t) and not num):
+            if (stpwd and t in self.stop_words) or (DIGIT_PATT.match(t) and not num):
                 continue
             res.append(t)
         return res
@@ -80,23 +102,39 @@ class Dealer:
         """获取命名实体识别（NER）标签"""
         return self.ne.get(t, "")
 
-    def weights(self, tks):
-        """计算权重（TF-IDF + NER）"""
-
-        def idf(s, N): return math.log10(10 + ((N - s + 0.5) / (s + 0.5)))
-
-        def term_freq(t):
-            return self.df.get(t, 3)  # 默认权重 3
+    def term_ids(self, tk):
+        """单个 token -> (合并后的词, 词表下标)，结果按 token 缓存"""
+        tt = tuple(self.tokenMerge(self.pretoken(tk, True)))
+        oov = len(self.vocab)
+        return tt, tuple(self.vocab.get(t, oov) for t in tt)
 
-        tw = []
+    def lookup(self, tks):
+        terms, ids = [], []
         for tk in tks:
-            tt = self.tokenMerge(self.pretoken(tk, True))
-            idf_values = np.array([idf(term_freq(t), 1000000) for t in tt])
-            weights = idf_values * np.array([1.5 if self.ner(t) else 1 for t in tt])
-            tw.extend(zip(tt, weights))
+            tt, ii = self.term_ids(tk)
+            terms.extend(tt)
+            ids.extend(ii)
+        return terms, ids
 
-        S = np.sum([s for _, s in tw])
-        return [(t, s / S) for t, s in tw] if S else tw
+    def weights(self, tks):
+        """计算权重（TF-IDF + NER）"""
+        return self.weights_batch([tks])[0]
+
+    def weights_batch(self, tks_list):
+        """批量计算多组 token 的权重：一次查表取出全部权重，再按组归一化"""
+        terms, ids, bounds = [], [], [0]
+        for tks in tks_list:
+            tt, ii = self.lookup(tks)
+            terms.extend(tt)
+            ids.extend(ii)
+            bounds.append(len(ids))
+
+        w = self.term_weight[np.array(ids, dtype=np.int64)]
+        res = []
+        for b, e in zip(bounds[:-1], bounds[1:]):
+            S = np.sum(w[b:e])
+            res.append(list(zip(terms[b:e], w[b:e] / S if S else w[b:e])))
+        return res
 
 
 # ========== 测试代码 ==========
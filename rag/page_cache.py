@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import os
+import threading
+from contextlib import suppress
+from pathlib import Path
+
+import cv2
+import fitz
+import numpy as np
+
+# 与 web/backend/main.py 的 /static-ocr-files 挂载目录一致：页面缓存位于 pages/，高亮结果位于 highlights/
+OCR_RESULTS_DIR = Path(__file__).resolve().parent.parent / "ocr_results"
+PAGE_CACHE_DIR = OCR_RESULTS_DIR / "pages"
+HIGHLIGHT_DIR = OCR_RESULTS_DIR / "highlights"
+STATIC_URL = "/static-ocr-files"
+
+PAGE_CACHE_MAX_BYTES = 512 * 1024 * 1024  # 缓存总大小上限
+HIGHLIGHT_MAX_BYTES = 256 * 1024 * 1024  # 高亮结果目录配额
+PREWARM_PAGES = 3  # 入库时预渲染每个文档的前几页
+RENDER_DPI = 216  # 与解析时 zoomin=3（72 * 3）一致
+
+
+def render_pdf_page(doc, page_number: int, dpi: int = RENDER_DPI):
+    """用 PyMuPDF 直接渲染指定页（页码从 1 开始）为 BGR 图像"""
+    pix = doc[page_number - 1].get_pixmap(dpi=dpi, alpha=False)
+    image = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)
+    return cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+
+
+def _stat_files(directory, suffixes) -> dict:
+    """directory 下指定后缀（不含临时文件）的 {路径: stat}，遍历期间被其他进程删除的文件直接跳过"""
+    stats = {}
+    for f in Path(directory).iterdir():
+        if f.suffix in suffixes and not f.name.endswith(".tmp" + f.suffix):
+            with suppress(FileNotFoundError):
+                stats[f] = f.stat()
+    return stats
+
+
+def evict_lru(directory, max_bytes: int, total: int = None, suffixes=(".jpg",)) -> int:
+    """按 mtime 从旧到新删除 directory 下指定后缀的文件，直到总大小不超过 max_bytes，返回剩余总大小"""
+    stats = _stat_files(directory, suffixes)
+    total = sum(st.st_size for st in stats.values()) if total is None else total
+    for f in sorted(stats, key=lambda f: stats[f].st_mtime):
+        if total <= max_bytes:
+            break
+        total -= stats[f].st_size
+        f.unlink(missing_ok=True)
+    return total
+
+
+def clean_highlights(max_bytes: int = HIGHLIGHT_MAX_BYTES):
+    """高亮结果目录（JPEG 与单页 PDF）的配额清理（由 web 后台定期调用）"""
+    if not HIGHLIGHT_DIR.exists():  # 尚未生成过高亮
+        return
+    suffixes = (".jpg", ".pdf")
+    before = sum(st.st_size for st in _stat_files(HIGHLIGHT_DIR, suffixes).values())
+    after = evict_lru(HIGHLIGHT_DIR, max_bytes, before, suffixes)
+    if after < before:
+        print(f"🧹 高亮结果清理: {before / 1e6:.1f}MB → {after / 1e6:.1f}MB")
+
+
+def static_url(path) -> str:
+    """ocr_results 下的文件路径 -> /static-ocr-files 下的访问地址"""
+    return f"{STATIC_URL}/{Path(path).resolve().relative_to(OCR_RESULTS_DIR).as_posix()}"
+
+
+class PageImageCache:
+    """
+    渲染页面图像的磁盘缓存
+    - key: (文件内容哈希, 页码, DPI)，文件被覆盖后哈希变化，旧图自然不再命中
+    - 命中时更新文件 mtime，超出 `max_bytes` 时按 mtime 从旧到新淘汰（LRU）
+    """
+
+    def __init__(self, cache_dir=PAGE_CACHE_DIR, max_bytes=PAGE_CACHE_MAX_BYTES):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self._hashes = {}  # (路径, 大小, mtime_ns) -> 内容哈希，避免重复读整份 PDF
+        self.size = sum(f.stat().st_size for f in self.cache_dir.glob("*.jpg"))
+        self.hits = 0
+        self.misses = 0
+
+    def file_hash(self, pdf_path: str) -> str:
+        st = os.stat(pdf_path)
+        key = (os.path.abspath(pdf_path), st.st_size, st.st_mtime_ns)
+        if key not in self._hashes:
+            with open(pdf_path, "rb") as f:
+                self._hashes[key] = hashlib.sha256(f.read()).hexdigest()[:24]
+        return self._hashes[key]
+
+    def path_for(self, pdf_path: str, page_number: int, dpi: int = RENDER_DPI) -> Path:
+        return self.cache_dir / f"{self.file_hash(pdf_path)}_{page_number}_{dpi}.jpg"
+
+    def get(self, pdf_path: str, page_number: int, dpi: int = RENDER_DPI, doc=None):
+        """返回页面 BGR 图像；未命中时渲染并写入缓存。`doc` 为已打开的 fitz 文档（可选）"""
+        path = self.path_for(pdf_path, page_number, dpi)
+        image = cv2.imread(str(path)) if path.exists() else None
+        if image is not None:
+            with suppress(FileNotFoundError):  # 读取后恰好被淘汰，图像已在内存中
+                os.utime(path)
+            self.hits += 1
+            return image
+
+        self.misses += 1
+        if doc is None:
+            with fitz.open(pdf_path) as doc:
+                image = render_pdf_page(doc, page_number, dpi)
+        else:
+            image = render_pdf_page(doc, page_number, dpi)
+        self._put(path, image)
+        return image
+
+    def _put(self, path: Path, image):
+        tmp_path = path.with_suffix(f".{threading.get_ident()}.tmp.jpg")
+        cv2.imwrite(str(tmp_path), image, [cv2.IMWRITE_JPEG_QUALITY, 95])
+        with self.lock:
+            old_size = path.stat().st_size if path.exists() else 0
+            os.replace(tmp_path, path)
+            self.size += path.stat().st_size - old_size
+            if self.size > self.max_bytes:  # 按最近访问时间淘汰到上限的 90%
+                self.size = evict_lru(self.cache_dir, int(self.max_bytes * 0.9))
+
+    def prewarm(self, pdf_path: str, pages: int = PREWARM_PAGES, dpi: int = RENDER_DPI):
+        """入库时预渲染前 `pages` 页"""
+        with fitz.open(pdf_path) as doc:
+            for page_number in range(1, min(pages, doc.page_count) + 1):
+                if not self.path_for(pdf_path, page_number, dpi).exists():
+                    self._put(self.path_for(pdf_path, page_number, dpi), render_pdf_page(doc, page_number, dpi))
+
+    def stats(self) -> dict:
+        return {"bytes": self.size, "max_bytes": self.max_bytes, "hits": self.hits, "misses": self.misses}
+
+
+page_cache = PageImageCache()
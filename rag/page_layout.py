@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import threading
+
+import fitz
+import numpy as np
+
+# 与 rag/data_devide.py 的 OUTPUT_FILE 一致
+POLICY_FILE = os.path.join(os.path.dirname(__file__), "res", "processed_policies.json")
+
+
+def pdf_page_cum_height(doc) -> list[float]:
+    """用 PyMuPDF 读取各页高度，返回累计高度 [0, h1, h1+h2, ...]（pt）"""
+    return np.cumsum([0.0] + [page.rect.height for page in doc]).tolist()
+
+
+def coordinate_array(coordinates: list[str]) -> np.ndarray:
+    """`@@页码 x0 top x1 bottom##` 坐标标签列表 -> (N, 5) 数组，top/bottom 为跨页累计高度"""
+    values = [coord.replace("@@", "").replace("##", "").split()[:5] for coord in coordinates]
+    return np.asarray(values, dtype=np.float64).reshape(-1, 5)
+
+
+def to_page_boxes(coordinates: list[str], page_cum_height) -> tuple[np.ndarray, np.ndarray]:
+    """
+    累计坐标 -> 页内坐标（向量化，一次处理所有坐标）
+    - `page_cum_height`: 各页累计高度 [0, h1, h1+h2, ...]（pt），第 n 页的页顶为 page_cum_height[n - 1]
+    返回 (页码 (N,), 页内框 (N, 4) [x0, y0, x1, y1]，pt，左上角为原点)
+    """
+    values = coordinate_array(coordinates)
+    pages = values[:, 0].astype(int)
+    boxes = values[:, 1:].copy()
+    boxes[:, [1, 3]] -= np.asarray(page_cum_height, dtype=np.float64)[pages - 1, None]
+    return pages, boxes
+
+
+class PageLayouts:
+    """
+    各文档的页面累计高度：
+    - 入库时由 PdfParser.page_cum_height 写入 processed_policies.json（与坐标标签出自同一次解析，页高不一致的文档也能对齐）
+    - 按 JSON 文件 mtime 缓存，重新入库后自动重新加载
+    - 旧数据没有记录时，用 PyMuPDF 读取页面尺寸计算（不重新 OCR）
+    """
+
+    def __init__(self, path=POLICY_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        self._mtime = None
+        self._layouts = {}  # 文件名 -> 累计高度
+        self._fallback = {}  # (路径, 大小, mtime_ns) -> 累计高度
+
+    def _reload(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return
+        if mtime == self._mtime:
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except json.JSONDecodeError:
+            return
+        self._layouts = {name: np.asarray(doc["page_cum_height"], dtype=np.float64)
+                         for name, doc in data.items() if doc.get("page_cum_height")}
+        self._mtime = mtime
+
+    def get(self, pdf_path: str) -> np.ndarray:
+        with self.lock:
+            self._reload()
+            layout = self._layouts.get(os.path.basename(pdf_path))
+            if layout is not None:
+                return layout
+
+            st = os.stat(pdf_path)
+            key = (os.path.abspath(pdf_path), st.st_size, st.st_mtime_ns)
+            if key not in self._fallback:
+                with fitz.open(pdf_path) as doc:
+                    self._fallback[key] = np.asarray(pdf_page_cum_height(doc))
+            return self._fallback[key]
+
+
+page_layouts = PageLayouts()
@@ -1,9 +1,13 @@
 import json
-import jieba
-import jieba.analyse
+import os
 import re
+import sys
 from collections import Counter
 
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../")))
+
+from rag.nlp import rag_tokenizer
+
 # 读取政策文件 JSON
 POLICY_FILE = "processed_policies.json"
 
@@ -23,12 +27,16 @@ def clean_text(text):
     return re.sub(r"@@\d+\t.*?##", "", text)
 
 
+# 批量分词（语料较小时单进程，较大时按 tokenize_many 的规则启用进程池），清理后为空的片段直接跳过
+def cut_texts(texts, workers=None):
+    cleaned = [text for text in map(clean_text, texts) if text.strip()]
+    return [tks.split() for tks in rag_tokenizer.tokenize_many(cleaned, workers=workers)]
+
+
 # 生成 huqie.txt 词典
-def generate_huqie(texts, output_file="huqie.txt", min_freq=5):
+def generate_huqie(texts, output_file="huqie.txt", min_freq=5, workers=None):
     word_freq = Counter()
-    for text in texts:
-        clean_text_chunk = clean_text(text)
-        words = jieba.cut(clean_text_chunk)
+    for words in cut_texts(texts, workers):
         word_freq.update(words)
 
     # 选取高频词并存储
@@ -40,11 +48,9 @@ def generate_huqie(texts, output_file="huqie.txt", min_freq=5):
 
 
 # 生成 term.freq 文件
-def generate_term_freq(texts, output_file="term.freq", min_freq=2):
+def generate_term_freq(texts, output_file="term.freq", min_freq=2, workers=None):
     term_counter = Counter()
-    for text in texts:
-        clean_text_chunk = clean_text(text)
-        words = jieba.lcut(clean_text_chunk)
+    for words in cut_texts(texts, workers):
         term_counter.update(words)
 
     # 选取高频词并存储
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+本地 Ollama 替身服务（仅依赖标准库），用于在没有模型的环境下测试 OllamaClient
+- 支持 /api/generate（含流式）、/api/embeddings、/api/embed、/api/ps
+- `--fail-rate` 按比例返回 503，用于验证重试逻辑；`--delay` 模拟生成耗时
+用法: python scripts/ollama_stub_server.py --port 11435 --fail-rate 0.2
+"""
+import argparse
+import hashlib
+import json
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+EMBED_DIM = 8
+
+
+def fake_embedding(text):
+    digest = hashlib.sha256(text.encode("utf-8")).digest()
+    return [b / 255 for b in digest[:EMBED_DIM]]
+
+
+def fake_answer(prompt):
+    if "关键词" in prompt and "近义词" in prompt:
+        return "<think>提取关键词</think>\n---\n关键词：推免 英语\n近义词：推免|保研 英语|外语\n---"
+    return "<think>根据上下文作答</think>\n根据《测试政策》规定，【测试原文】。"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+    fail_rate = 0.0
+    delay = 0.0
+    loaded = {}  # 模型名 -> keep_alive，模拟 /api/ps
+
+    def _send(self, status, body, content_type="application/json"):
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if random.random() < self.fail_rate:
+            return self._send(503, json.dumps({"error": "stub: service unavailable"}))
+        time.sleep(self.delay)
+        if payload.get("model"):
+            self.loaded[payload["model"]] = payload.get("keep_alive", "5m")
+
+        if self.path == "/api/generate":
+            answer = fake_answer(payload.get("prompt", ""))
+            if not payload.get("stream", True):
+                return self._send(200, json.dumps({"model": payload.get("model"), "response": answer, "done": True},
+                                                  ensure_ascii=False))
+            lines = [json.dumps({"response": c, "done": False}, ensure_ascii=False) for c in answer]
+            lines.append(json.dumps({"response": "", "done": True}))
+            return self._send(200, "\n".join(lines) + "\n", "application/x-ndjson")
+
+        if self.path == "/api/embeddings":
+            return self._send(200, json.dumps({"embedding": fake_embedding(payload.get("prompt", ""))}))
+
+        if self.path == "/api/embed":
+            inputs = payload.get("input", [])
+            inputs = [inputs] if isinstance(inputs, str) else inputs
+            return self._send(200, json.dumps({"model": payload.get("model"),
+                                               "embeddings": [fake_embedding(t) for t in inputs]}))
+
+        self._send(404, json.dumps({"error": f"stub: unknown endpoint {self.path}"}))
+
+    def do_GET(self):
+        if self.path == "/api/ps":
+            return self._send(200, json.dumps({"models": [{"name": m, "expires_at": f"keep_alive={k}"}
+                                                          for m, k in self.loaded.items()]}))
+        self._send(404, json.dumps({"error": f"stub: unknown endpoint {self.path}"}))
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port=11435, fail_rate=0.0, delay=0.0):
+    StubHandler.fail_rate = fail_rate
+    StubHandler.delay = delay
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubHandler)
+    print(f"🧪 Ollama 替身服务已启动: http://127.0.0.1:{server.server_port}")
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--delay", type=float, default=0.0)
+    args = parser.parse_args()
+    serve(args.port, args.fail_rate, args.delay).serve_forever()
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+分词器微基准：在政策语料上对比旧实现（逐字符拼接 / 逐次 re 匹配 / 窗口重复扫描）与当前实现的单行耗时
+用法: python -m scripts.tokenizer_benchmark [重复次数]
+"""
+import json
+import math
+import os
+import re
+import sys
+import time
+
+from hanziconv import HanziConv
+from rag.nlp import rag_tokenizer
+
+POLICY_FILE = os.path.join(os.path.dirname(__file__), "..", "rag", "res", "processed_policies.json")
+
+
+def load_lines():
+    with open(POLICY_FILE, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    lines = []
+    for doc_data in data.values():
+        for chunk in doc_data.get("text_chunks", []):
+            lines.extend(l for l in re.sub(r"@@[\t0-9.-]+?##", "", chunk).split("\n") if l.strip())
+    return lines
+
+
+# ========== 旧实现（仅用于对比） ==========
+def legacy_normalize(line):
+    rstring = ""
+    for uchar in line:
+        inside_code = ord(uchar)
+        if inside_code == 0x3000:
+            inside_code = 0x0020
+        else:
+            inside_code -= 0xfee0
+        if inside_code < 0x0020 or inside_code > 0x7e:
+            rstring += uchar
+        else:
+            rstring += chr(inside_code)
+    line = HanziConv.toSimplified(rstring.lower())
+    zh_num = len([1 for c in line if rag_tokenizer.is_chinese(c)])
+    return line, zh_num > 0
+
+
+def legacy_merge(tk, tks):
+    res = []
+    tks = re.sub(r"[ ]+", " ", tks).split(" ")
+    s = 0
+    while True:
+        if s >= len(tks):
+            break
+        E = s + 1
+        for e in range(s + 2, min(len(tks) + 2, s + 6)):
+            t = "".join(tks[s:e])
+            k = str(t.lower().encode("utf-8"))[2:-1]
+            if re.search(tk.SPLIT_CHAR, t) and k in tk.trie_ and \
+                    int(math.exp(tk.trie_[k][0]) * tk.DENOMINATOR + 0.5):
+                E = e
+        res.append("".join(tks[s:E]))
+        s = E
+    return " ".join(res)
+
+
+def current_normalize(line):
+    line = rag_tokenizer.tokenizer._normalize(line)
+    return line, rag_tokenizer._ZH_RE.search(line) is not None
+
+
+def bench(desc, func, inputs, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        out = [func(x) for x in inputs]
+    per_line = (time.perf_counter() - start) / (repeat * len(inputs)) * 1e6
+    print(f"  {desc:<12} {per_line:8.2f} µs/行")
+    return out, per_line
+
+
+def run(repeat=5):
+    tk = rag_tokenizer.tokenizer
+    lines = load_lines()
+    print(f"\n📊 分词微基准：{len(lines)} 行，重复 {repeat} 次\n")
+
+    print("🔹 文本归一化（全角转半角 + 小写 + 繁转简 + 中文判断）")
+    old, t_old = bench("旧实现", legacy_normalize, lines, repeat)
+    new, t_new = bench("当前实现", current_normalize, lines, repeat)
+    assert old == new, "归一化结果不一致"
+    print(f"  ⚡ 加速 {t_old / t_new:.1f}x\n")
+
+    # merge_ 的输入是 tokenize 合并前的空格分词结果
+    merged_inputs = [" ".join(l.split()) for l in (tk.tokenize(l) for l in lines)]
+    print("🔹 merge_ 窗口合并")
+    old, t_old = bench("旧实现", lambda l: legacy_merge(tk, l), merged_inputs, repeat)
+    new, t_new = bench("当前实现", tk.merge_, merged_inputs, repeat)
+    assert old == new, "merge_ 结果不一致"
+    print(f"  ⚡ 加速 {t_old / t_new:.1f}x\n")
+
+    print("🔹 tokenize 整体")
+    bench("当前实现", tk.tokenize, lines, repeat)
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
@@ -1,12 +1,42 @@
 from fastapi import APIRouter, WebSocket
+import asyncio
 import json
 import re
-from rag.inference import search_engine, engine, extract_keywords, filter_top_results, format_search_results
-from rag.match import process_pdf_highlight
+from rag.inference import engine, speculative_search_async, filter_top_results, format_search_results, \
+    embed_question_async, lookup_answer, store_answer, is_cacheable_answer, scheduler, client, pdf_base_path, \
+    highlight_mode
+from rag.match import highlight_citations, annotate_citations
+from rag.page_cache import static_url
+from rag.llm.think_splitter import ThinkSplitter
 
 router = APIRouter()
 
 
+def clean_results_for_display(results):
+    """💡 清洗前端展示内容（删除坐标等，仅限展示用）"""
+    cleaned_results = []
+    for r in results:
+        clean_r = {"文件": r["文件"], "搜索分数": r["搜索分数"], "相关内容": []}
+        for c in r["相关内容"]:
+            text = re.sub(r"@@.*?##", "", c[0]).strip()
+            clean_r["相关内容"].append((text, c[1], c[2] if len(c) > 2 else ""))
+        cleaned_results.append(clean_r)
+    return cleaned_results
+
+
+def highlight_payload(highlights):
+    """高亮结果 -> 前端格式：图片地址 + {图片序号: 地址}（图片序号与回答中的 [🖼️N] 对应；JPEG / 单页 PDF 均走 /static-ocr-files）"""
+    items = [{"文件": h["文件"], "页码": h["页码"], "url": static_url(h["图片"]), "引用序号": h["引用序号"]}
+             for h in highlights]
+    return items, {n: item["url"] for n, item in enumerate(items, 1)}
+
+
+@router.get("/llm-stats")
+async def llm_stats():
+    """LLM 调度统计：各模型在途/排队数、各优先级排队等待时间、合并请求数，以及连接复用情况"""
+    return {"scheduler": scheduler.stats(), "connections": client.connection_stats()}
+
+
 @router.websocket("/ws/answer")
 async def websocket_answer(websocket: WebSocket):
     await websocket.accept()
@@ -18,79 +48,85 @@ async def websocket_answer(websocket: WebSocket):
             # 🔹 左侧显示用户原始提问
             await websocket.send_text(json.dumps({"type": "user_question", "message": question}))
 
-            # 🔍 提取关键词
-            keywords, synonyms = extract_keywords(question, use_llm=True)
-            if not keywords:
-                await websocket.send_text(json.dumps({"type": "error", "message": "❌ 无法解析问题，请尝试更具体的提问。"}))
+            # ⚡ 语义答案缓存：近义问题直接返回已生成的回答与高亮
+            embedding = await embed_question_async(question)
+            cached = await asyncio.to_thread(lookup_answer, question, embedding)
+            if cached:
+                await websocket.send_text(json.dumps({"type": "query_keywords", "message": cached["optimized_query"]}))
+                await websocket.send_text(json.dumps({"type": "search_results",
+                                                      "results": clean_results_for_display(cached["sorted_results"])}))
+                items, urls = highlight_payload(cached["highlights"])
+                answer = annotate_citations(cached["final_answer"], cached["highlights"])
+                await websocket.send_text(json.dumps({"type": "answer", "message": answer, "images": urls}))
+                await websocket.send_text(json.dumps({"type": "highlight", "images": items}))
                 continue
 
-            expanded_query = set(keywords)
-            for key, syns in synonyms.items():
-                expanded_query.update(syns)
-            search_query = " ".join(expanded_query)
+            # 🔍 提取关键词 + 🔎 搜索排序（NLP 关键词检索与 LLM 关键词提取并行）
+            search_query, results, _ = await speculative_search_async(question, top_k=5)
+            if not search_query:
+                await websocket.send_text(json.dumps({"type": "error", "message": "❌ 无法解析问题，请尝试更具体的提问。"}))
+                continue
 
             # 🔍 推送优化搜索关键词
             await websocket.send_text(json.dumps({"type": "query_keywords", "message": search_query}))
 
-            # 🔎 搜索排序
-            results = search_engine.search(search_query, top_k=5)
             if not results:
                 await websocket.send_text(json.dumps({"type": "error", "message": "❌ 没有找到相关政策"}))
                 continue
 
-            # 💡 清洗前端展示内容（删除坐标等，仅限展示用）
-            cleaned_results = []
-            for r in results:
-                clean_r = {"文件": r["文件"], "搜索分数": r["搜索分数"], "相关内容": []}
-                for c in r["相关内容"]:
-                    text = re.sub(r"@@.*?##", "", c[0]).strip()
-                    clean_r["相关内容"].append((text, c[1], c[2] if len(c) > 2 else ""))
-                cleaned_results.append(clean_r)
-
-            await websocket.send_text(json.dumps({"type": "search_results", "results": cleaned_results}))
+            await websocket.send_text(json.dumps({"type": "search_results",
+                                                  "results": clean_results_for_display(results)}))
 
             # ✨ 选定文段用于回答
             filtered = filter_top_results(results)
             formatted = format_search_results(filtered)
             await websocket.send_text(json.dumps({"type": "thinking", "message": "📄 已选定相关文段用于回答..."}))
 
-            # 🧠 LLM 思考生成回答
-            raw_answer = engine.answer_question(question, filtered)
-            await websocket.send_text(json.dumps({"type": "thinking", "message": raw_answer}))
+            # 🧠 LLM 思考生成回答（逐 token 推送：思考过程 thinking_delta，正文 answer_delta）
+            stream = await engine.answer_question_async(question, filtered, stream=True)
+            splitter = ThinkSplitter()
+            answer_parts = []
+            raw_parts = []
+            async for chunk in stream:
+                raw_parts.append(chunk)
+                for kind, text in splitter.feed(chunk):
+                    if kind == "answer":
+                        answer_parts.append(text)
+                    await websocket.send_text(json.dumps({"type": f"{kind}_delta", "message": text}))
+            for kind, text in splitter.flush():
+                if kind == "answer":
+                    answer_parts.append(text)
+                await websocket.send_text(json.dumps({"type": f"{kind}_delta", "message": text}))
+
+            # ✅ 去掉思考过程后的最终回答
+            cleaned = "".join(answer_parts).strip()
+
+            # 🖼️ 批量高亮所有引用（按 (文件, 页码) 分组并行渲染，文件名按内容寻址，并发会话互不覆盖）
+            highlights = await asyncio.to_thread(
+                highlight_citations, pdf_base_path, cleaned.split("\n"), filtered, mode=highlight_mode
+            )
+            items, urls = highlight_payload(highlights)
 
-            # ✅ 清理标签后的最终回答
-            cleaned = re.sub(r"<think>.*?</think>", "", raw_answer, flags=re.DOTALL).strip()
+            # 在每条引用后插入 [🖼️N] 并发送回答（附带 图片序号 -> 图片地址，供前端点击预览）
+            cleaned_with_refs = annotate_citations(cleaned, highlights)
+            await websocket.send_text(json.dumps({"type": "answer", "message": cleaned_with_refs, "images": urls}))
 
-            # 🖼️ 高亮截图路径（先处理图片）
-            matched_images = process_pdf_highlight(
-                "data/policy", cleaned.split("\n"), filtered,
-                output_dir="C:/Users/ROG/PycharmProjects/final/ocr_results"
-            )
+            # 推送高亮图片列表（文件、页码、地址、引用序号）
+            await websocket.send_text(json.dumps({"type": "highlight", "images": items}))
 
-            # 🖼️ 插入引用标注（根据 matched_images 文件名提取页码插入）
-            def insert_image_refs_by_filename(text, matched_images):
-                from pathlib import Path
-                image_ids = []
-                for path in matched_images:
-                    filename = Path(path).name
-                    match = re.match(r"(\d+)_highlighted\.jpg", filename)
-                    if match:
-                        image_ids.append(int(match.group(1)))
-
-                pattern = r"《(.*?)》"
-                matches = list(re.finditer(pattern, text))
-                for idx, match in enumerate(matches):
-                    if idx < len(image_ids):
-                        ref = f"《{match.group(1)}》[🖼️{image_ids[idx]}]"
-                        text = text.replace(match.group(0), ref, 1)
-                return text
-
-            # 插入引用标注并发送回答
-            cleaned_with_refs = insert_image_refs_by_filename(cleaned, matched_images)
-            await websocket.send_text(json.dumps({"type": "answer", "message": cleaned_with_refs}))
-
-            # 推送图片路径列表（前端可预览）
-            await websocket.send_text(json.dumps({"type": "highlight", "images": matched_images}))
+            # ⚡ 写入语义答案缓存（格式与 answer_policy_question 的返回值一致；生成失败 / 空回答 / 无引用时跳过）
+            if not is_cacheable_answer("".join(raw_parts), cleaned, highlights):
+                continue
+            await asyncio.to_thread(store_answer, embedding, {
+                "raw_question": question,
+                "optimized_query": search_query,
+                "sorted_results": results,
+                "filtered_results": filtered,
+                "llm_thinking": "".join(raw_parts),
+                "final_answer": cleaned,
+                "reference_images": [h["图片"] for h in highlights],
+                "highlights": highlights
+            })
 
 
         except Exception as e:
@@ -1,7 +1,9 @@
+import asyncio
 import logging
 from fastapi import APIRouter, UploadFile, Form
 from fastapi.responses import JSONResponse, HTMLResponse
 import os
+import re
 import shutil
 import time
 from pathlib import Path
@@ -9,7 +11,9 @@ from urllib.parse import unquote
 from docx2pdf import convert
 import pandas as pd
 
-from rag.data_devide import process_policy_file, load_existing_data, save_json, convert_all_docx_to_pdf
+from rag.data_devide import process_policy_files, load_existing_data, save_json, convert_all_docx_to_pdf
+from rag.inference import answer_cache
+from rag.nlp import rag_tokenizer
 import mammoth
 
 # 初始化日志
@@ -67,6 +71,7 @@ async def upload_file(file: UploadFile):
 
             temp_path.unlink()
             logger.info(f"🧹 临时 Word 文件已删除")
+            answer_cache.invalidate_file(final_pdf_path.name)  # 覆盖上传时，引用旧文件的缓存回答失效
 
             return JSONResponse(content={"message": f"✅ Word 文件已转换为 PDF 并上传完成", "status": "success"})
 
@@ -75,6 +80,7 @@ async def upload_file(file: UploadFile):
             with open(save_path, "wb") as buffer:
                 shutil.copyfileobj(file.file, buffer)
             logger.info(f"💾 非 Word 文件已保存: {save_path}")
+            answer_cache.invalidate_file(original_name)  # 覆盖上传时，引用旧文件的缓存回答失效
 
             return JSONResponse(content={"message": f"✅ 文件 {original_name} 上传完成", "status": "success"})
 
@@ -167,6 +173,7 @@ async def delete_file(filename: str):
             logger.info(f"🗑️ 文件 {filename} 已删除")
         else:
             logger.warning(f"⚠️ 文件 {filename} 不存在")
+        answer_cache.invalidate_file(unquote(filename))
 
         # ✅ 确保解析数据也被删除
         data = load_existing_data()
@@ -185,32 +192,51 @@ async def delete_file(filename: str):
 
 @router.post("/parse-all/")
 async def parse_all_files():
-    """解析所有未解析的文件"""
+    """解析所有未解析的文件（多进程并行，每个文件解析完成即写入）"""
     try:
-        data = load_existing_data()
-        parsed_count = 0
+        # Word 已在上传时转换为 PDF，这里不再转换
+        summary = await asyncio.to_thread(
+            process_policy_files, policy_dir=UPLOAD_DIR, convert_docx=False,
+            callback=lambda prog, msg: logger.info(f"📊 解析进度 {prog:.0%}: {msg}"))
+        for file in summary["parsed_files"]:
+            answer_cache.invalidate_file(file)  # 重新解析后文段与坐标可能变化
+        for file in summary["failed"]:
+            logger.warning(f"⚠️ 文件 {file} 解析失败")
+
+        return JSONResponse(content={"message": f"✅ 已成功解析 {summary['parsed']} 个文件", "status": "success",
+                                     **summary})
 
-        for file in os.listdir(UPLOAD_DIR):
-            if file in data:
-                continue  # 已解析跳过
+    except Exception as e:
+        logger.error(f"❌ 批量解析失败: {str(e)}")
+        return JSONResponse(content={"message": f"❌ 批量解析失败: {str(e)}", "status": "error"}, status_code=500)
 
-            file_path = UPLOAD_DIR / file
-            parsed = process_policy_file(str(file_path))
-            if parsed:
-                data[file] = parsed
-                parsed_count += 1
-                logger.info(f"✅ 已解析文件：{file}")
-            else:
-                logger.warning(f"⚠️ 文件 {file} 解析失败")
 
-        save_json(data)
 
-        return JSONResponse(content={"message": f"✅ 已成功解析 {parsed_count} 个文件", "status": "success"})
+USER_TERM_RE = re.compile(r"[\u4e00-\u9fa5a-zA-Z0-9·._-]{1,32}")
+USER_TAG_RE = re.compile(r"[a-z]{1,4}")
+USER_TERM_MAX_FREQ = 10 ** 9
 
-    except Exception as e:
-        logger.error(f"❌ 批量解析失败: {str(e)}")
-        return JSONResponse(content={"message": f"❌ 批量解析失败: {str(e)}", "status": "error"}, status_code=500)
 
+@router.post("/user-dict/")
+async def add_user_term(word: str = Form(...), freq: int = Form(1000), tag: str = Form("n")):
+    """新增分词词条（如新的项目名称），立即生效并在后台写入用户词典"""
+    word, tag = word.strip(), tag.strip()
+    if not USER_TERM_RE.fullmatch(word):
+        return JSONResponse(content={"message": "❌ 词条需为 1~32 个中文、字母、数字或 ·._- 字符", "status": "error"},
+                            status_code=400)
+    if not 1 <= freq <= USER_TERM_MAX_FREQ:
+        return JSONResponse(content={"message": f"❌ 词频需在 1~{USER_TERM_MAX_FREQ} 之间", "status": "error"},
+                            status_code=400)
+    if not USER_TAG_RE.fullmatch(tag):
+        return JSONResponse(content={"message": "❌ 词性需为 1~4 个小写字母", "status": "error"}, status_code=400)
+    try:
+        rag_tokenizer.add_term(word, freq, tag)
+        logger.info(f"📖 已添加词条: {word} ({freq}, {tag})")
+        return JSONResponse(content={"message": f"✅ 已添加词条 {word}", "status": "success"})
+
+    except Exception as e:
+        logger.error(f"❌ 添加词条失败: {str(e)}")
+        return JSONResponse(content={"message": f"❌ 添加词条失败: {str(e)}", "status": "error"}, status_code=500)
 
 
 @router.get("/view-file/{filename}")
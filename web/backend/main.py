@@ -3,8 +3,13 @@ from fastapi.responses import HTMLResponse
 from fastapi.responses import JSONResponse
 from pathlib import Path
 import shutil
+import asyncio
 from fastapi.staticfiles import StaticFiles
 from web.backend.api import chat, file
+from rag.inference import async_client
+from rag.llm.config import OLLAMA_CONFIG
+from rag.llm.warmup import ModelWarmer
+from rag.page_cache import OCR_RESULTS_DIR, clean_highlights
 from fastapi.templating import Jinja2Templates
 from fastapi import Request
 from fastapi.responses import FileResponse
@@ -18,13 +23,47 @@ UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
 app.mount("/static-files", StaticFiles(directory=UPLOAD_DIR), name="static-files")
 
 # 确保 OCR 结果目录被挂载为静态文件
-OCR_RESULTS_DIR = Path(__file__).resolve().parent.parent.parent / "ocr_results"
 OCR_RESULTS_DIR.mkdir(parents=True, exist_ok=True)
 
-# 挂载 OCR 文件目录，映射为 /static-ocr-files 路径
+# 挂载 OCR 文件目录，映射为 /static-ocr-files 路径（页面图像缓存位于 /static-ocr-files/pages/）
 app.mount("/static-ocr-files", StaticFiles(directory=OCR_RESULTS_DIR), name="static-ocr-files")
 
 
+# ✅ 模型预热：启动时加载对话/嵌入模型，空闲过久后重新预热
+warmer = ModelWarmer(async_client, OLLAMA_CONFIG)
+
+
+HIGHLIGHT_JANITOR_INTERVAL = 10 * 60  # 高亮结果目录配额检查间隔（秒）
+
+
+async def highlight_janitor():
+    """后台定期按配额清理高亮结果（按最近访问时间淘汰）"""
+    while True:
+        try:
+            await asyncio.to_thread(clean_highlights)
+        except Exception as e:
+            print(f"⚠️ 高亮结果清理失败: {e}")
+        await asyncio.sleep(HIGHLIGHT_JANITOR_INTERVAL)
+
+
+@app.on_event("startup")
+async def start_background_tasks():
+    app.state.background_tasks = [asyncio.create_task(warmer.run()), asyncio.create_task(highlight_janitor())]
+
+
+@app.on_event("shutdown")
+async def stop_background_tasks():
+    for task in app.state.background_tasks:
+        task.cancel()
+    await async_client.aclose()
+
+
+@app.get("/ready")
+async def readiness():
+    """就绪检查：所有预热模型加载完成返回 200，否则 503"""
+    status = await warmer.status()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
 # ✅ 模板渲染
 templates = Jinja2Templates(directory="web/frontend/templates")
 